@@ -0,0 +1,294 @@
+'''
+Benchmarks of the hot paths of detl, run with the sqlite backend in a temporary folder so that they need no
+server :
+
+    python -m benchmarks.run [--quick] [--results benchmarks/results.jsonl] [--check]
+
+Every metric is a time in seconds, lower is better. Each run is appended to the results file, and compared
+with the median of the previous runs of the same machine and size : the metrics slower by more than the
+tolerance are reported as regressions, --check then exits with an error
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import numpy as np
+import detl.cache
+from detl.backends import SqliteBackend
+from detl.identity import Identity
+from detl.mydb import MyDb
+from detl.processor import load_and_save
+from detl.serializers import SERIALIZERS, load_auto
+
+DEFAULT_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl')
+# A metric regresses if it is slower than the median of the previous runs by more than this share
+DEFAULT_TOLERANCE = 0.25
+# The differences below this time are noise
+NOISE = 1e-6
+# Number of previous runs the new one is compared with
+HISTORY = 5
+
+# The sizes of the benchmarks, the quick ones only check that the suite runs
+SIZES = {
+    'full': {'calls': 500, 'depths': [10, 100, 1000], 'widths': [10, 100, 1000], 'array_size': 64 << 20,
+             'collections': [1000, 10000, 100000], 'lookups': 200, 'format_size': 64 << 20,
+             'result_counts': [100, 1000, 10000]},
+    'quick': {'calls': 20, 'depths': [10], 'widths': [10], 'array_size': 1 << 20,
+              'collections': [100], 'lookups': 20, 'format_size': 1 << 20, 'result_counts': [50]},
+}
+
+# The benchmarks, registered by the benchmark decorator
+BENCHMARKS = []
+
+
+def benchmark(fn):
+    '''A benchmark, fn(db, sizes) returns its metrics by name'''
+    BENCHMARKS.append(fn)
+    return fn
+
+
+def best_time(fn, repeat=5, number=1):
+    '''The shortest time of number calls to fn, over repeat runs, per call'''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return min(times)
+
+
+@load_and_save()
+def add_one(num):
+    return num + 1
+
+
+def _undecorated_add_one(num):
+    return num + 1
+
+
+@benchmark
+def decorator_overhead(db, sizes):
+    '''Time of a call to a decorated function and of getting its data, for the misses and for the hits'''
+    calls = sizes['calls']
+    metrics = {'decorator/no db': best_time(lambda: _undecorated_add_one(1), number=calls)}
+    with db.as_default():
+        start = time.perf_counter()
+        for i in range(calls):
+            add_one(i).data
+        metrics['decorator/miss'] = (time.perf_counter() - start) / calls
+        metrics['decorator/memory hit'] = best_time(lambda: add_one(0).data, number=calls)
+
+        def disk_hits():
+            detl.cache.result_cache.clear()
+            for i in range(calls):
+                add_one(i).data
+        metrics['decorator/disk hit'] = best_time(disk_hits, repeat=3) / calls
+    return metrics
+
+
+@benchmark
+def identity_hashing(db, sizes):
+    '''Time to hash a chain of depth identities, and an identity with width arguments'''
+    metrics = {}
+    for depth in sizes['depths']:
+        def chain():
+            identity = Identity('source', 0)
+            for i in range(depth):
+                identity = Identity('step', identity, i)
+            return identity
+        metrics['hash/depth %d' % depth] = _hash_time(chain)
+    for width in sizes['widths']:
+        metrics['hash/width %d' % width] = _hash_time(
+            lambda: Identity('merge', *[Identity('source', i) for i in range(width)]))
+    array = np.random.default_rng(0).random(sizes['array_size'] // 8)
+    metrics['hash/array %dMiB' % (sizes['array_size'] >> 20)] = best_time(
+        lambda: Identity('source', array).__id_hash__(), repeat=3)
+    return metrics
+
+
+def _hash_time(build):
+    '''The time to hash a new graph of identities, without building it'''
+    times = []
+    for _ in range(5):
+        identity = build()
+        start = time.perf_counter()
+        identity.__id_hash__()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+@benchmark
+def lookup_latency(db, sizes):
+    '''Time to look up the metadata of a result (not cached), by number of results in the db'''
+    metrics = {}
+    inserted = 0
+    for count in sizes['collections']:
+        identities = [Identity('source', i) for i in range(inserted, count)]
+        for i in range(0, len(identities), 10000):
+            db.insert_sources(identities[i:i + 10000])
+        inserted = count
+
+        rng = np.random.default_rng(0)
+        lookups = [Identity('source', int(i)) for i in rng.integers(0, count, sizes['lookups'])]
+        db.meta_cache.clear()
+        start = time.perf_counter()
+        for identity in lookups:
+            db.find(identity)
+        metrics['lookup/find %d' % count] = (time.perf_counter() - start) / len(lookups)
+
+        db.meta_cache.clear()
+        start = time.perf_counter()
+        db.find_many([Identity('source', int(i)) for i in rng.integers(0, count, sizes['lookups'])])
+        metrics['lookup/find_many %d per result' % count] = (time.perf_counter() - start) / sizes['lookups']
+    return metrics
+
+
+@benchmark
+def format_throughput(db, sizes):
+    '''Time to save and to load (reading all the data) a result in each format'''
+    import pandas as pd
+
+    size = sizes['format_size']
+    array = np.random.default_rng(0).random(size // 8)
+    objects = {'pickle': array, 'npy': array,
+               'columns': pd.DataFrame(array.reshape(-1, 4), columns=list('abcd')),
+               'packed': (array[:len(array) // 2], array[len(array) // 2:])}
+    folder = tempfile.mkdtemp(dir=db.data_folder)
+    metrics = {}
+    for name, obj in objects.items():
+        serializer = SERIALIZERS[name]
+        path = os.path.join(folder, name + serializer.extension)
+
+        def save():
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            serializer.save(obj, path)
+        metrics['format/save %s %dMiB' % (name, size >> 20)] = best_time(save, repeat=3)
+        metrics['format/load %s %dMiB' % (name, size >> 20)] = best_time(lambda: _read(load_auto(path)), repeat=3)
+    shutil.rmtree(folder)
+    return metrics
+
+
+def _read(obj):
+    '''Read all the data of a loaded result, the memory mapped formats are read lazily'''
+    if isinstance(obj, (list, tuple)):
+        return [_read(el) for el in obj]
+    return np.asarray(obj).sum()
+
+
+@benchmark
+def ancestor_queries(db, sizes):
+    '''Time of has_ancestor for one result, and of filter_by_ancestor for all of them, by number of results'''
+    metrics = {}
+    for count in sizes['result_counts']:
+        db.drop_all()
+        sources = [Identity('load', i) for i in range(count)]
+        db.insert_sources(sources)
+        trained = [Identity('train', source, kernel='poly' if i % 2 else 'rbf') for i, source in enumerate(sources)]
+        db.insert_sources(trained)
+        scores = [Identity('score', model) for model in trained]
+        db.insert_sources(scores)
+        docs = db.find_many(scores)
+
+        query = {'name': 'train', 'kwargs': {'kernel': 'poly'}}
+        metrics['ancestor/has_ancestor %d' % count] = best_time(lambda: db.has_ancestor(docs[-1], query))
+        metrics['ancestor/filter_by_ancestor %d' % count] = best_time(
+            lambda: db.filter_by_ancestor(docs, query), repeat=3)
+    return metrics
+
+
+def run(sizes='full', data_folder=None):
+    '''Run all the benchmarks in a temporary data folder, returns the metrics by name'''
+    folder = tempfile.mkdtemp(dir=data_folder)
+    try:
+        metrics = {}
+        for bench in BENCHMARKS:
+            db = MyDb(data_folder=folder, backend=SqliteBackend(os.path.join(folder, '%s.sqlite' % bench.__name__)))
+            db.drop_all()
+            metrics.update(bench(db, SIZES[sizes]))
+            detl.cache.result_cache.clear()
+        return metrics
+    finally:
+        shutil.rmtree(folder)
+
+
+def machine():
+    '''The machine the benchmarks run on, only the runs of the same machine are compared'''
+    return '%s %s %s python %s' % (platform.node(), platform.machine(), platform.processor(),
+                                   platform.python_version())
+
+
+def load_history(path, sizes):
+    '''The previous runs of this machine and size, oldest first'''
+    if not os.path.exists(path):
+        return []
+    with open(path) as fd:
+        runs = [json.loads(line) for line in fd if line.strip()]
+    return [r for r in runs if r['machine'] == machine() and r['sizes'] == sizes]
+
+
+def compare(metrics, history, tolerance=DEFAULT_TOLERANCE):
+    '''
+    Compare the metrics with the median of the last runs, returns (name, value, baseline) for all the metrics
+    (baseline is None for new ones) and the names of the ones that regressed
+    '''
+    rows = []
+    regressions = []
+    for name, value in metrics.items():
+        previous = [r['metrics'][name] for r in history[-HISTORY:] if name in r['metrics']]
+        baseline = statistics.median(previous) if previous else None
+        rows.append((name, value, baseline))
+        if baseline is not None and value > baseline * (1 + tolerance) and value - baseline > NOISE:
+            regressions.append(name)
+    return rows, regressions
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '%.2f%s' % (seconds / scale, unit)
+    return '%.0fns' % (seconds * 1e9)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the hot paths of detl')
+    parser.add_argument('--quick', action='store_true', help='small sizes, to check that the suite runs')
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help='the file where the runs are appended')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--check', action='store_true', help='exit with an error if a metric regressed')
+    parser.add_argument('--data-folder', help='where the temporary data is written, the system default otherwise')
+    args = parser.parse_args(argv)
+
+    sizes = 'quick' if args.quick else 'full'
+    history = load_history(args.results, sizes)
+    metrics = run(sizes, args.data_folder)
+    rows, regressions = compare(metrics, history, args.tolerance)
+
+    for name, value, baseline in rows:
+        line = '%-45s %10s' % (name, format_time(value))
+        if baseline is not None:
+            line += ' %10s %+7.1f%%%s' % (format_time(baseline), 100 * (value / baseline - 1) if baseline else 0,
+                                          '  REGRESSION' if name in regressions else '')
+        print(line)
+
+    record = {'date': datetime.now(timezone.utc).isoformat(), 'machine': machine(), 'sizes': sizes,
+              'metrics': metrics}
+    with open(args.results, 'a') as fd:
+        fd.write(json.dumps(record) + '\n')
+
+    if regressions:
+        print('%d metrics regressed by more than %d%%' % (len(regressions), 100 * args.tolerance))
+        if args.check:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
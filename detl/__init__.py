@@ -1,3 +1,6 @@
 import detl.identity
 import detl.processor
 import detl.mydb
+from detl.planner import materialize
+from detl.dataset import Dataset, PartitionedSource
+from detl.trace import profile
@@ -0,0 +1,533 @@
+import logging
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from pymongo import MongoClient, IndexModel, UpdateOne, ReplaceOne, ReturnDocument
+from pymongo.errors import OperationFailure
+from bson.objectid import ObjectId
+from bson.json_util import dumps, loads
+
+
+class MetadataBackend(object):
+    '''
+    The storage of the metadata documents. A document has an _id (an ObjectId), a unique config_hash, a name,
+    the args and kwargs of the configuration where the identified arguments are object ids, and the parents
+    (the object ids in args and kwargs). The projections are hints : a backend may return more fields
+    '''
+
+    def find_one(self, hash_val, projection=None):
+        '''The document of a config hash, None if absent'''
+        raise NotImplementedError
+
+    def find_many(self, hashes, projection=None):
+        '''The documents of several config hashes, in any order, without the absent ones'''
+        raise NotImplementedError
+
+    def find_id(self, obj_id):
+        raise NotImplementedError
+
+    def find_ids(self, obj_ids):
+        '''The documents of several object ids, in any order'''
+        raise NotImplementedError
+
+    def insert(self, doc):
+        '''Insert a document, replacing the one with the same config hash if any. Returns its object id'''
+        raise NotImplementedError
+
+    def insert_many(self, docs):
+        '''Insert several documents at once (see insert). Returns their object ids in the same order'''
+        return [self.insert(doc) for doc in docs]
+
+    def set_fields(self, hash_val, fields):
+        '''Set some fields of the document of a config hash'''
+        doc = self.find_one(hash_val)
+        if doc is not None:
+            doc.update(fields)
+            self.insert(doc)
+
+    def list_results(self, fn_name):
+        raise NotImplementedError
+
+    def find(self, query, projection=None):
+        '''The documents matching a mongo style query, an iterable read as it is consumed'''
+        raise NotImplementedError
+
+    def forget_files(self, hashes):
+        '''
+        Remove the file of several results from their documents, which are kept : the results are identified but
+        not stored, and computed again when they are needed
+        '''
+        docs = list(self.find_many(hashes))
+        for doc in docs:
+            for field in FILE_FIELDS:
+                doc.pop(field, None)
+        self.insert_many(docs)
+
+    def find_by_fingerprints(self, query, fingerprints):
+        '''The documents matching a query whose fingerprints (see detl.mydb.node_fingerprints) include all the given ones'''
+        raise NotImplementedError
+
+    def lineage(self, obj_ids):
+        '''
+        The object ids of the ancestors of several documents, including themselves, as a dict. The graph is
+        walked up one level at a time with a single query per level
+        '''
+        origins = defaultdict(set)
+        for obj_id in obj_ids:
+            origins[obj_id].add(obj_id)
+
+        frontier = set(obj_ids)
+        while frontier:
+            next_frontier = set()
+            for doc in self.find_ids(frontier):
+                for parent in parent_ids(doc):
+                    new_origins = origins[doc['_id']] - origins[parent]
+                    if new_origins:
+                        origins[parent] |= new_origins
+                        next_frontier.add(parent)
+            frontier = next_frontier
+
+        lineage = {obj_id: set() for obj_id in obj_ids}
+        for node, node_origins in origins.items():
+            for origin in node_origins:
+                lineage[origin].add(node)
+        return lineage
+
+    def filter_by_ancestor(self, obj_ids, query):
+        '''The object ids of the documents that match the query or have an ancestor matching it'''
+        lineage = self.lineage(obj_ids)
+        nodes = set().union(*lineage.values())
+        matching = {doc['_id'] for doc in self.find_ids(nodes) if matches(doc, query)}
+        return [obj_id for obj_id in obj_ids if lineage[obj_id] & matching]
+
+    def ensure_indexes(self):
+        pass
+
+    def migrate(self):
+        '''Upgrade the storage created by an older version of detl'''
+        pass
+
+    def drop(self):
+        raise NotImplementedError
+
+
+def parent_ids(doc):
+    '''The object ids of the parents of a document, also for the documents written before the parents field'''
+    if 'parents' in doc:
+        return doc['parents']
+    values = list(doc.get('args', [])) + list(doc.get('kwargs', {}).values())
+    return [value for value in values if type(value) is ObjectId]
+
+
+def backend_from_config(config):
+    '''The backend described by a db config, mongo by default'''
+    backend = config.get('backend', 'mongo')
+    if backend == 'mongo':
+        return MongoBackend(config['host'], config['port'], config['db'], config['collection'],
+                            **config.get('client_options', {}))
+    if backend == 'sqlite':
+        return SqliteBackend(config['path'])
+    raise ValueError('Unknown metadata backend %s' % backend)
+
+
+def _restore_mongo_backend(settings, options):
+    return MongoBackend(*settings, **options)
+
+
+# The fields of a document describing the file of its result
+FILE_FIELDS = ('file_descriptor', 'artifact', 'format', 'index')
+
+
+# The indexes of the metadata collection. The parents field holds the object ids of the identified arguments
+INDEXES = [IndexModel('config_hash', unique=True, name='config_hash_unique'),
+           IndexModel('name', name='name'),
+           IndexModel('parents', name='parents'),
+           IndexModel('ancestors', name='ancestors'),
+           IndexModel('fingerprints', name='fingerprints')]
+
+
+# The mongo clients of this process, by host, port and options, see get_client
+_clients = {}
+_clients_lock = threading.Lock()
+_clients_pid = os.getpid()
+
+
+def get_client(host, port, **options):
+    '''
+    The client of a mongo server, shared by all the backends of the process with the same host, port and
+    options (e.g. maxPoolSize, serverSelectionTimeoutMS, socketTimeoutMS, readPreference, see MongoClient),
+    so that they share its pool of connections. The clients are not used after a fork : the child process
+    creates its own ones
+    '''
+    global _clients_pid
+    key = (host, port, tuple(sorted(options.items())))
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            # The clients inherited from the parent share its sockets and can hold its locks
+            _clients.clear()
+            _clients_pid = os.getpid()
+        client = _clients.get(key)
+        if client is None:
+            # The connection is opened by the first query, not while the client may still be forked
+            client = _clients[key] = MongoClient(host, port, **dict({'connect': False}, **options))
+        return client
+
+
+def _forget_clients():
+    global _clients_lock
+    _clients.clear()
+    # The lock may have been held by another thread of the parent while forking
+    _clients_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_clients)
+
+
+class MongoBackend(MetadataBackend):
+
+    def __init__(self, host, port, db, collection, **options):
+        '''A mongo collection, options are given to the client (see get_client)'''
+        self.settings = (host, port, db, collection)
+        self.options = options
+
+    def __reduce__(self):
+        '''Sent to the worker processes as its settings, they connect again'''
+        return _restore_mongo_backend, (self.settings, self.options)
+
+    @property
+    def client(self):
+        host, port, _, _ = self.settings
+        return get_client(host, port, **self.options)
+
+    @property
+    def db(self):
+        return self.client[self.settings[2]]
+
+    @property
+    def coll(self):
+        return self.db[self.settings[3]]
+
+    def find_one(self, hash_val, projection=None):
+        return self.coll.find_one({'config_hash': hash_val}, projection)
+
+    def find_many(self, hashes, projection=None):
+        return self.coll.find({'config_hash': {'$in': list(hashes)}}, projection)
+
+    def find_id(self, obj_id):
+        return self.coll.find_one({'_id': obj_id})
+
+    def find_ids(self, obj_ids):
+        return self.coll.find({'_id': {'$in': list(obj_ids)}})
+
+    def insert(self, doc):
+        post = self.coll.find_one_and_replace({'config_hash': doc['config_hash']}, doc, projection={'_id': 1},
+                                              upsert=True, return_document=ReturnDocument.AFTER)
+        return post['_id']
+
+    def insert_many(self, docs):
+        '''A single bulk write, then a single query for the object ids of the replaced documents'''
+        if not docs:
+            return []
+        result = self.coll.bulk_write([ReplaceOne({'config_hash': doc['config_hash']}, doc, upsert=True)
+                                       for doc in docs], ordered=False)
+        obj_ids = dict(result.upserted_ids)
+        replaced = [doc['config_hash'] for i, doc in enumerate(docs) if i not in obj_ids]
+        if replaced:
+            found = {doc['config_hash']: doc['_id'] for doc in self.find_many(replaced, {'_id': 1, 'config_hash': 1})}
+            obj_ids.update((i, found[doc['config_hash']]) for i, doc in enumerate(docs) if i not in obj_ids)
+        return [obj_ids[i] for i in range(len(docs))]
+
+    def list_results(self, fn_name):
+        return self.coll.find({'name': fn_name})
+
+    def find(self, query, projection=None):
+        return self.coll.find(query, projection)
+
+    def set_fields(self, hash_val, fields):
+        self.coll.update_one({'config_hash': hash_val}, {'$set': fields})
+
+    def forget_files(self, hashes):
+        hashes = list(hashes)
+        for i in range(0, len(hashes), 1000):
+            self.coll.update_many({'config_hash': {'$in': hashes[i:i + 1000]}},
+                                  {'$unset': {field: '' for field in FILE_FIELDS}})
+
+    def find_by_fingerprints(self, query, fingerprints):
+        if fingerprints:
+            query = dict(query, fingerprints={'$all': fingerprints})
+        return self.coll.find(query)
+
+    def _graph_lookup(self, obj_ids):
+        '''The stages adding the ancestors of the documents, walked up by the server'''
+        return [{'$match': {'_id': {'$in': list(obj_ids)}}},
+                {'$graphLookup': {'from': self.coll.name,
+                                  'startWith': '$parents',
+                                  'connectFromField': 'parents',
+                                  'connectToField': '_id',
+                                  'as': 'ancestors'}}]
+
+    def lineage(self, obj_ids):
+        pipeline = self._graph_lookup(obj_ids) + [{'$project': {'ancestors._id': 1}}]
+        lineage = {obj_id: {obj_id} for obj_id in obj_ids}
+        for doc in self.coll.aggregate(pipeline, allowDiskUse=True):
+            lineage[doc['_id']] |= {ancestor['_id'] for ancestor in doc['ancestors']}
+        return lineage
+
+    def filter_by_ancestor(self, obj_ids, query):
+        pipeline = self._graph_lookup(obj_ids) + [
+            {'$match': {'$or': [query, {'ancestors': {'$elemMatch': query}}]}},
+            {'$project': {'_id': 1}}]
+        matching = {doc['_id'] for doc in self.coll.aggregate(pipeline, allowDiskUse=True)}
+        return [obj_id for obj_id in obj_ids if obj_id in matching]
+
+    def ensure_indexes(self):
+        '''Create the indexes of the metadata collection if they do not exist yet'''
+        try:
+            self.coll.create_indexes(INDEXES)
+        except OperationFailure:
+            # The collection has duplicated config hashes, create the other indexes until it is migrated
+            logging.warning('Could not create the unique config_hash index on %s, call MyDb.migrate()', self.coll.name)
+            self.coll.create_indexes([index for index in INDEXES if not index.document.get('unique')])
+
+    def migrate(self):
+        '''
+        Migrate a collection created by an older version of detl : merge the documents sharing a config hash
+        (keeping one with a file), fill the parents field and create the indexes
+        '''
+        # Missing file descriptors sort last, so the first id of each group has a file if any does
+        duplicates = self.coll.aggregate([
+            {'$sort': {'file_descriptor': -1}},
+            {'$group': {'_id': '$config_hash', 'count': {'$sum': 1}, 'ids': {'$push': '$_id'}}},
+            {'$match': {'count': {'$gt': 1}}}], allowDiskUse=True)
+
+        replaced = {}
+        for dup in duplicates:
+            for obj_id in dup['ids'][1:]:
+                replaced[obj_id] = dup['ids'][0]
+        if replaced:
+            self.coll.delete_many({'_id': {'$in': list(replaced)}})
+
+        # Point the references to the merged documents and fill the parents
+        ops = []
+        for doc in self.coll.find({}, {'args': 1, 'kwargs': 1}):
+            args = [replaced.get(arg, arg) if type(arg) is ObjectId else arg for arg in doc.get('args', [])]
+            kwargs = {k: replaced.get(v, v) if type(v) is ObjectId else v for k, v in doc.get('kwargs', {}).items()}
+            parents = list(dict.fromkeys(v for v in args + list(kwargs.values()) if type(v) is ObjectId))
+            ops.append(UpdateOne({'_id': doc['_id']}, {'$set': {'args': args, 'kwargs': kwargs, 'parents': parents}}))
+            if len(ops) == 1000:
+                self.coll.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            self.coll.bulk_write(ops, ordered=False)
+
+        self.ensure_indexes()
+
+    def drop(self):
+        self.coll.drop()
+        self.ensure_indexes()
+
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metadata (
+    id TEXT PRIMARY KEY,
+    config_hash TEXT NOT NULL UNIQUE,
+    name TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS metadata_name ON metadata (name);
+CREATE TABLE IF NOT EXISTS parents (
+    id TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    PRIMARY KEY (id, parent)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS parents_parent ON parents (parent);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    id TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    PRIMARY KEY (id, fingerprint)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS fingerprints_fingerprint ON fingerprints (fingerprint);
+'''
+
+# Maximum number of parameters of a sqlite query
+SQLITE_MAX_PARAMS = 900
+# Number of documents read by a query of a scan of the sqlite metadata
+SQLITE_SCAN_PAGE = 1000
+
+
+class SqliteBackend(MetadataBackend):
+
+    def __init__(self, path):
+        '''
+        Metadata stored in a local sqlite database in WAL mode, for single node use and for the tests. The
+        documents are stored as extended json, the config hash, name and parents are indexed columns. The folder
+        of the database is created if it does not exist
+        '''
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._local = threading.local()
+        self.ensure_indexes()
+
+    def __reduce__(self):
+        return SqliteBackend, (self.path,)
+
+    @property
+    def conn(self):
+        '''A connection per thread, created again in forked processes'''
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _query(self, sql, params=()):
+        return [loads(row[0]) for row in self.conn.execute(sql, params)]
+
+    def _query_in(self, sql, values):
+        '''Run a query with an IN (?) clause over values, by chunks'''
+        values = list(values)
+        results = []
+        for i in range(0, len(values), SQLITE_MAX_PARAMS):
+            chunk = values[i:i + SQLITE_MAX_PARAMS]
+            results += self._query(sql % ','.join('?' * len(chunk)), chunk)
+        return results
+
+    def find_one(self, hash_val, projection=None):
+        docs = self._query('SELECT doc FROM metadata WHERE config_hash = ?', (hash_val,))
+        return docs[0] if docs else None
+
+    def find_many(self, hashes, projection=None):
+        return self._query_in('SELECT doc FROM metadata WHERE config_hash IN (%s)', hashes)
+
+    def find_id(self, obj_id):
+        docs = self._query('SELECT doc FROM metadata WHERE id = ?', (str(obj_id),))
+        return docs[0] if docs else None
+
+    def find_ids(self, obj_ids):
+        return self._query_in('SELECT doc FROM metadata WHERE id IN (%s)', [str(obj_id) for obj_id in obj_ids])
+
+    def insert(self, doc):
+        return self.insert_many([doc])[0]
+
+    def insert_many(self, docs):
+        '''The documents are written in a single transaction'''
+        conn = self.conn
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            return [self._insert(conn, doc) for doc in docs]
+
+    def _insert(self, conn, doc):
+        row = conn.execute('SELECT id FROM metadata WHERE config_hash = ?', (doc['config_hash'],)).fetchone()
+        obj_id = ObjectId(row[0]) if row else doc.get('_id', ObjectId())
+        doc = dict(doc, _id=obj_id)
+        conn.execute('INSERT OR REPLACE INTO metadata (id, config_hash, name, doc) VALUES (?, ?, ?, ?)',
+                     (str(obj_id), doc['config_hash'], doc.get('name'), dumps(doc)))
+        conn.execute('DELETE FROM parents WHERE id = ?', (str(obj_id),))
+        conn.executemany('INSERT OR IGNORE INTO parents (id, parent) VALUES (?, ?)',
+                         [(str(obj_id), str(parent)) for parent in doc.get('parents', [])])
+        conn.execute('DELETE FROM fingerprints WHERE id = ?', (str(obj_id),))
+        conn.executemany('INSERT OR IGNORE INTO fingerprints (id, fingerprint) VALUES (?, ?)',
+                         [(str(obj_id), fingerprint) for fingerprint in doc.get('fingerprints', [])])
+        return obj_id
+
+    def list_results(self, fn_name):
+        return self._query('SELECT doc FROM metadata WHERE name = ?', (fn_name,))
+
+    def lineage(self, obj_ids):
+        '''The ancestors are walked up by a recursive query on the parents table'''
+        sql = '''
+            WITH RECURSIVE lineage(origin, id) AS (
+                SELECT id, id FROM metadata WHERE id IN (%s)
+                UNION
+                SELECT lineage.origin, parents.parent FROM parents JOIN lineage ON parents.id = lineage.id)
+            SELECT origin, id FROM lineage'''
+        lineage = {obj_id: {obj_id} for obj_id in obj_ids}
+        values = [str(obj_id) for obj_id in obj_ids]
+        for i in range(0, len(values), SQLITE_MAX_PARAMS):
+            chunk = values[i:i + SQLITE_MAX_PARAMS]
+            for origin, node in self.conn.execute(sql % ','.join('?' * len(chunk)), chunk):
+                lineage[ObjectId(origin)].add(ObjectId(node))
+        return lineage
+
+    def find(self, query, projection=None):
+        if '_id' in query and not isinstance(query['_id'], dict):
+            candidates = self._query('SELECT doc FROM metadata WHERE id = ?', (str(query['_id']),))
+        elif 'config_hash' in query and not isinstance(query['config_hash'], dict):
+            candidates = self._query('SELECT doc FROM metadata WHERE config_hash = ?', (query['config_hash'],))
+        elif 'name' in query and not isinstance(query['name'], dict):
+            candidates = self.list_results(query['name'])
+        else:
+            candidates = self._scan()
+        return (doc for doc in candidates if matches(doc, query))
+
+    def _scan(self):
+        '''All the documents, read by pages of ids so that the database is not locked while they are used'''
+        last_id = ''
+        while True:
+            rows = self.conn.execute('SELECT id, doc FROM metadata WHERE id > ? ORDER BY id LIMIT ?',
+                                     (last_id, SQLITE_SCAN_PAGE)).fetchall()
+            for _, doc in rows:
+                yield loads(doc)
+            if len(rows) < SQLITE_SCAN_PAGE:
+                return
+            last_id = rows[-1][0]
+
+    def find_by_fingerprints(self, query, fingerprints):
+        if not fingerprints:
+            return list(self.find(query))
+        fingerprints = list(dict.fromkeys(fingerprints))
+        sql = '''
+            SELECT doc FROM metadata WHERE id IN (
+                SELECT id FROM fingerprints WHERE fingerprint IN (%s)
+                GROUP BY id HAVING COUNT(*) = ?)''' % ','.join('?' * len(fingerprints))
+        candidates = self._query(sql, fingerprints + [len(fingerprints)])
+        return [doc for doc in candidates if matches(doc, query)]
+
+    def ensure_indexes(self):
+        self.conn.executescript(SQLITE_SCHEMA)
+
+    def drop(self):
+        self.conn.executescript('DROP TABLE IF EXISTS metadata; DROP TABLE IF EXISTS parents; '
+                                'DROP TABLE IF EXISTS fingerprints;')
+        self.ensure_indexes()
+
+
+def matches(doc, query):
+    '''
+    Whether a document matches a mongo style query, for the backends that are not mongo. Only the equality
+    (of values or subdocuments, or membership for arrays), $in, $ne and $exists are supported
+    '''
+    for key, expected in query.items():
+        if key.startswith('$'):
+            raise ValueError('Unsupported query operator %s' % key)
+        value = doc
+        for part in key.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+
+        if isinstance(expected, dict) and expected and all(k.startswith('$') for k in expected):
+            for op, arg in expected.items():
+                if op == '$in':
+                    if not any(_equals(value, el) for el in arg):
+                        return False
+                elif op == '$ne':
+                    if _equals(value, arg):
+                        return False
+                elif op == '$exists':
+                    if (value is not None) != bool(arg):
+                        return False
+                else:
+                    raise ValueError('Unsupported query operator %s' % op)
+        elif not _equals(value, expected):
+            return False
+    return True
+
+
+def _equals(value, expected):
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
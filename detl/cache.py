@@ -0,0 +1,102 @@
+import sys
+from collections import OrderedDict
+from threading import RLock
+
+# Default memory budget of the result cache, in bytes
+DEFAULT_MEMORY_BUDGET = 512 * 1024 ** 2
+
+
+def sizeof(obj):
+    '''Estimated size in bytes of a result, using nbytes for numpy arrays and memory_usage for pandas objects'''
+    memory_usage = getattr(obj, 'memory_usage', None)
+    if callable(memory_usage):
+        usage = memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+    nbytes = getattr(obj, 'nbytes', None)
+    if nbytes is not None:
+        return int(nbytes)
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(sizeof(el) for el in obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(sizeof(k) + sizeof(v) for k, v in obj.items())
+    return sys.getsizeof(obj)
+
+
+class LRUCache(object):
+
+    def __init__(self, maxsize=10000, sizeof=None):
+        '''
+        A bounded mapping that evicts the least recently used entries, with hit and miss counters.
+        The size of an entry is given by sizeof (1 by default). A maxsize of 0 disables the cache
+        '''
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = RLock()
+
+    def get(self, key, default=None, accept=None):
+        '''The value for key, or default. Values rejected by the accept predicate are counted as misses'''
+        with self._lock:
+            if key in self._entries:
+                value = self._entries[key]
+                if accept is None or accept(value):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        '''The value for key, without updating the counters nor the recency'''
+        with self._lock:
+            return self._entries.get(key, default)
+
+    def put(self, key, value):
+        entry_size = 1 if self.sizeof is None else self.sizeof(value)
+        with self._lock:
+            self.pop(key)
+            # Entries larger than the whole cache are not stored
+            if entry_size > self.maxsize:
+                return
+            self._entries[key] = value
+            self._sizes[key] = entry_size
+            self.size += entry_size
+            self._evict()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self.size -= self._sizes.pop(key)
+            return self._entries.pop(key)
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.maxsize:
+            key, _ = self._entries.popitem(last=False)
+            self.size -= self._sizes.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.size = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries),
+                'size': self.size, 'maxsize': self.maxsize}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Results of the identified computations shared by the whole process, keyed by db token and identity hash
+result_cache = LRUCache(DEFAULT_MEMORY_BUDGET, sizeof=sizeof)
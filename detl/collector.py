@@ -0,0 +1,230 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from detl.store import written_paths, _remove
+
+# Age in seconds after which a temporary file or a stored result that no metadata refers to is abandoned. A
+# result being written is referred to once its metadata is inserted
+DEFAULT_MIN_AGE = 3600
+# The value of keeping a result halves every half life (in seconds) it is not used
+DEFAULT_HALF_LIFE = 7 * 24 * 3600
+# Compute time of the results whose compute time is not recorded, in seconds
+UNKNOWN_COST = 1.0
+# Number of files or documents handled by a step of the collection
+BATCH_SIZE = 1000
+
+# The fields of the metadata read by the collection
+SCAN_PROJECTION = {'config_hash': 1, 'file_descriptor': 1, 'artifact': 1, 'compute_time': 1}
+
+# The files saved before the artifact store, data_folder/name/<timestamp><hash>
+LEGACY_FILE = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}[0-9a-f]+')
+
+
+def compute_cost(doc):
+    '''The cost of computing a result again, its compute time if it is recorded'''
+    compute_time = doc.get('compute_time')
+    return UNKNOWN_COST if compute_time is None else compute_time
+
+
+class GarbageCollector(object):
+
+    def __init__(self, db, max_size=None, min_age=DEFAULT_MIN_AGE, half_life=DEFAULT_HALF_LIFE, cost=compute_cost,
+                 batch_size=BATCH_SIZE):
+        '''
+        Deletes the files of the data folder of a db that are not needed anymore :
+        - the temporary files of the results whose saving was interrupted
+        - the stored results and the files of older versions of detl that no metadata refers to
+        - with max_size, the results that are least worth keeping until the stored results fit in max_size bytes.
+          A result is worth its cost (cost(doc), by default its compute time) per byte, halved every half_life
+          seconds it is not used
+        The metadata of the deleted results and of the results whose file is missing is kept without the file :
+        they are identified but not stored, and computed again when they are needed.
+
+        The collection runs by steps of batch_size files or documents, and can be interrupted between two steps
+        (see collect). The files are locked one at a time, and the files created or used while it runs are kept
+        '''
+        self.db = db
+        self.max_size = max_size
+        self.min_age = min_age
+        self.half_life = half_life
+        self.cost = cost
+        self.batch_size = batch_size
+        self.stats = None
+        self._steps = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def collect(self, max_seconds=None):
+        '''
+        Run the collection for at most max_seconds, until it is complete by default. The next call resumes it
+        where it stopped. Returns the counts of the current collection, with done True once it is complete
+        '''
+        deadline = None if max_seconds is None else time.monotonic() + max_seconds
+        if self._steps is None:
+            self.stats = {'temporary': 0, 'orphans': 0, 'missing': 0, 'evicted': 0, 'freed': 0, 'done': False}
+            self._steps = self._cycle()
+        for _ in self._steps:
+            if deadline is not None and time.monotonic() >= deadline:
+                return self.stats
+        self._steps = None
+        self.stats['done'] = True
+        logging.info('Collected %(temporary)d temporary files, %(orphans)d orphans and %(evicted)d evicted results '
+                     '(%(freed)d bytes), %(missing)d results had no file', self.stats)
+        return self.stats
+
+    def start(self, interval=600, max_seconds=1.0):
+        '''
+        Collect in a background thread, by slices of max_seconds separated by as long pauses, and start again
+        interval seconds after each complete collection
+        '''
+        def run():
+            while not self._stop.is_set():
+                try:
+                    stats = self.collect(max_seconds)
+                except Exception:
+                    logging.exception('The garbage collection of %s failed', self.db.data_folder)
+                    self._steps = None
+                    stats = {'done': True}
+                self._stop.wait(interval if stats['done'] else max_seconds)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name='detl-collector', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _cycle(self):
+        started = time.time()
+        store = self.db.store
+        yield from self._clean_temporary(started - self.min_age)
+
+        # The documents of the stored results by digest, and the files of older versions
+        by_digest = defaultdict(list)
+        legacy = set()
+        docs = self.db.backend.find({'file_descriptor': {'$exists': True}}, SCAN_PROJECTION)
+        missing = []
+        for i, doc in enumerate(docs):
+            if 'artifact' in doc:
+                by_digest[doc['artifact']['digest']].append(doc)
+            else:
+                legacy.add(_legacy_name(doc['file_descriptor']))
+            if not self._has_file(doc):
+                missing.append(doc['config_hash'])
+            if (i + 1) % self.batch_size == 0:
+                yield from self._forget(missing, 'missing')
+                missing = []
+        yield from self._forget(missing, 'missing')
+
+        blobs = []
+        for i, (blob, size, last_use) in enumerate(store._local_blobs()):
+            if os.path.basename(blob) in by_digest:
+                blobs.append((blob, size, last_use))
+            elif last_use < started - self.min_age:
+                freed = store.delete(blob, unless_used_since=started - self.min_age)
+                if freed:
+                    self.stats['orphans'] += 1
+                    self.stats['freed'] += freed
+            if (i + 1) % self.batch_size == 0:
+                yield
+
+        yield from self._clean_legacy(legacy, started - self.min_age)
+
+        if self.max_size is not None:
+            yield from self._evict(blobs, by_digest, started)
+
+    def _clean_temporary(self, before):
+        '''Delete the temporary files older than before, left by interrupted saves'''
+        tmp_folder = self.db.store.tmp_folder
+        if not os.path.isdir(tmp_folder):
+            return
+        for i, entry in enumerate(os.scandir(tmp_folder)):
+            try:
+                if entry.stat(follow_symlinks=False).st_mtime < before:
+                    _remove(entry.path)
+                    self.stats['temporary'] += 1
+            except FileNotFoundError:
+                # Moved to the store meanwhile
+                pass
+            if (i + 1) % self.batch_size == 0:
+                yield
+
+    def _clean_legacy(self, used, before):
+        '''Delete the files saved by older versions of detl that no metadata refers to'''
+        data_folder = self.db.data_folder
+        store = self.db.store
+        if data_folder is None or not os.path.isdir(data_folder):
+            return
+        count = 0
+        store_folders = {os.path.abspath(store.tmp_folder), os.path.abspath(store.objects_folder)}
+        for entry in os.scandir(data_folder):
+            if not entry.is_dir() or os.path.abspath(entry.path) in store_folders:
+                continue
+            for file_entry in os.scandir(entry.path):
+                if not LEGACY_FILE.match(file_entry.name) or _legacy_name(file_entry.path) in used:
+                    continue
+                stat = file_entry.stat(follow_symlinks=False)
+                if stat.st_mtime < before:
+                    self.stats['freed'] += stat.st_size
+                    self.stats['orphans'] += 1
+                    _remove(file_entry.path)
+                count += 1
+                if count % self.batch_size == 0:
+                    yield
+
+    def _evict(self, blobs, by_digest, started):
+        '''Delete the stored results worth the least per byte until they fit in max_size'''
+        total = sum(size for _, size, _ in blobs)
+        if total <= self.max_size:
+            return
+
+        def value(blob):
+            path, size, last_use = blob
+            cost = max(self.cost(doc) for doc in by_digest[os.path.basename(path)])
+            return cost * 0.5 ** (max(0, started - last_use) / self.half_life) / max(size, 1)
+
+        evicted = []
+        for blob, _, _ in sorted(blobs, key=value):
+            if total <= self.max_size:
+                break
+            freed = self.db.store.delete(blob, unless_used_since=started)
+            if freed:
+                total -= freed
+                self.stats['evicted'] += 1
+                self.stats['freed'] += freed
+                if self.db.store.remote is None:
+                    # Other nodes may still download the result from the remote store
+                    evicted += [doc['config_hash'] for doc in by_digest[os.path.basename(blob)]]
+            if len(evicted) >= self.batch_size:
+                yield from self._forget(evicted, None)
+                evicted = []
+        yield from self._forget(evicted, None)
+
+    def _forget(self, hashes, counter):
+        if hashes:
+            self.db.forget_files(hashes)
+            if counter is not None:
+                self.stats[counter] += len(hashes)
+        yield
+
+    def _has_file(self, doc):
+        store = self.db.store
+        if 'artifact' not in doc:
+            return os.path.exists(doc['file_descriptor']) or bool(written_paths(doc['file_descriptor']))
+        if store.remote is not None:
+            # Downloaded when it is needed
+            return True
+        blob = store._blob(doc['artifact']['digest'])
+        return all(os.path.exists(blob + name) for name in doc['artifact']['files'])
+
+
+def _legacy_name(fd):
+    '''A file saved by an older version, without the extension added by its save function'''
+    return os.path.join(os.path.abspath(os.path.dirname(fd)), os.path.basename(fd).split('.')[0])
+
@@ -0,0 +1,190 @@
+import glob
+import itertools
+import json
+import os
+from bson.json_util import dumps
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from detl.db_context import db_context
+from detl.identity import Identity, h11, to_serializable
+from detl.executor import graph
+from detl.planner import Plan
+from detl.wrapper import Wrapper, get_data
+
+# Number of elements looked up, computed and kept in memory at once
+DEFAULT_CHUNK_SIZE = 1000
+
+
+class Dataset(object):
+
+    def __init__(self, elements, name, key=None):
+        '''
+        A collection of elements processed one at a time, e.g. the images of a folder. elements can be any
+        iterable, a generator is read lazily. Each element is identified by the name of the dataset and its
+        key, key(element), so that the results computed from each element are saved and loaded separately.
+        Without key, an element is identified by its position and its content (see element_fingerprint)
+        '''
+        self.elements = elements
+        self.name = name
+        self.key = key
+
+    def wrappers(self, db):
+        '''The identified elements, or the elements themselves without db'''
+        for i, element in enumerate(self.elements):
+            if db is None:
+                yield element
+            elif self.key is None:
+                yield wrap_element(element, self.name, i, fingerprint=element_fingerprint(element))
+            else:
+                yield wrap_element(element, self.name, self.key(element))
+
+    def map(self, fn, *args, **kwargs):
+        '''
+        The dataset of the results of fn(element, *args, **kwargs) for each element, where fn is decorated
+        with load_and_save or identity_wrapper. Nothing is computed before the data is streamed
+        '''
+        return MappedDataset(self, fn, args, kwargs)
+
+    def stream(self, executor=None, max_workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        '''
+        The data of the elements, in order. The elements are processed by chunks of chunk_size : the results
+        of a chunk are looked up in a single query, the saved ones are loaded and the others computed by the
+        executor (see detl.planner.Plan), whose pool is shared by all the chunks. Only one chunk is in memory
+        at a time, and an interrupted run resumes from the results already saved
+        '''
+        db = db_context.get_db()
+        wrappers = self.wrappers(db)
+        if db is None:
+            for wrapper in wrappers:
+                yield get_data(wrapper)
+            return
+
+        executor = executor or db.executor or 'serial'
+        max_workers = max_workers or db.max_workers
+        pool = None
+        if executor == 'thread':
+            pool = ThreadPoolExecutor(max_workers)
+        elif executor == 'process':
+            pool = ProcessPoolExecutor(max_workers)
+
+        try:
+            while True:
+                chunk = list(itertools.islice(wrappers, chunk_size))
+                if not chunk:
+                    break
+                _insert_elements(db, chunk)
+                for data in Plan(chunk, db).execute(executor=executor, max_workers=max_workers, pool=pool):
+                    yield data
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    def __iter__(self):
+        return self.stream()
+
+    def reduce(self, fn, *args, **kwargs):
+        '''
+        fn(*results, *args, **kwargs) where results are the results of all the elements, e.g. to recombine the
+        results computed on each partition of a PartitionedSource. With detl.materialize or in lazy mode, the
+        results of the elements are only loaded or computed if the result of fn is not saved
+        '''
+        db = db_context.get_db()
+        results = list(self.wrappers(db))
+        if db is not None:
+            _insert_elements(db, results)
+        return fn(*results, *args, **kwargs)
+
+    def compute(self, executor=None, max_workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        '''Compute and save the results that are not saved yet, returns the number of elements'''
+        count = 0
+        for _ in self.stream(executor=executor, max_workers=max_workers, chunk_size=chunk_size):
+            count += 1
+        return count
+
+
+class MappedDataset(Dataset):
+
+    def __init__(self, parent, fn, args, kwargs):
+        '''The results of a function on each element of a dataset, see Dataset.map'''
+        self.parent = parent
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def wrappers(self, db):
+        for wrapper in self.parent.wrappers(db):
+            yield self.fn(wrapper, *self.args, **self.kwargs)
+
+
+class PartitionedSource(Dataset):
+
+    def __init__(self, partitions, name, fingerprint=None):
+        '''
+        A source split in partitions, e.g. the files of a folder. partitions is a dict of partitions by key, or a
+        list of partitions that are their own key (e.g. paths). Each partition is an element of the dataset,
+        identified by its key and its fingerprint, fingerprint(partition), by default the size and modification
+        time of the files (see partition_fingerprint). After a partition is added or modified, only the
+        results computed from it are computed again, the others are loaded
+        '''
+        if not isinstance(partitions, dict):
+            partitions = {partition: partition for partition in partitions}
+        super(PartitionedSource, self).__init__(list(partitions.values()), name)
+        self.partitions = partitions
+        fingerprint = fingerprint or partition_fingerprint
+        self.fingerprints = {key: fingerprint(partition) for key, partition in partitions.items()}
+        # The identity of the whole source is given by the fingerprints of the partitions
+        self.identity = Identity('partitioned_source', self.name, partitions=sorted(self.fingerprints.items()))
+
+    @classmethod
+    def from_folder(cls, folder, name, pattern='*'):
+        '''The files of a folder matching a pattern, each file is a partition'''
+        return cls(sorted(glob.glob(os.path.join(glob.escape(folder), pattern))), name)
+
+    def __id_hash__(self):
+        return self.identity.__id_hash__()
+
+    def wrappers(self, db):
+        for key, partition in self.partitions.items():
+            if db is None:
+                yield partition
+            else:
+                yield wrap_element(partition, self.name, key, fingerprint=self.fingerprints[key])
+
+
+def partition_fingerprint(partition):
+    '''The size and modification time of a file, or the content of other partitions'''
+    if isinstance(partition, str) and os.path.isfile(partition):
+        stat = os.stat(partition)
+        return h11('%d %d' % (stat.st_size, stat.st_mtime_ns))
+    return h11(dumps(partition, sort_keys=True))
+
+
+def element_fingerprint(element):
+    '''
+    The fingerprint of the content of an element : the arrays and the pandas objects are identified by their
+    memory buffers (see detl.fingerprint), the other elements by their JSON serialization
+    '''
+    try:
+        return h11(json.dumps(element, sort_keys=True, default=to_serializable))
+    except (TypeError, AttributeError):
+        raise ValueError('The elements of type %s cannot be identified by their content, give the dataset a key'
+                         % type(element).__name__)
+
+
+def _insert_elements(db, wrappers):
+    '''Insert the elements needed by wrappers, so that the results computed from them can be found by ancestry'''
+    db.insert_sources([node.identity for node in graph(wrappers).values() if node.fn is dataset_element])
+
+
+def dataset_element(dataset, key, fingerprint=None):
+    '''The function of the identity of the elements of a dataset, their data is given'''
+    raise ValueError('The element %s of %s is not available' % (key, dataset))
+
+
+def wrap_element(element, dataset, key, fingerprint=None):
+    '''An identified element of a dataset, key must be serializable'''
+    kwargs = {'dataset': dataset, 'key': key}
+    if fingerprint is not None:
+        kwargs['fingerprint'] = fingerprint
+    wrapper = Wrapper(dataset_element, [], kwargs)
+    wrapper._data = element
+    return wrapper
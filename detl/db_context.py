@@ -1,29 +1,64 @@
 from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
 
 class DbStack():
 
     def __init__(self):
+        '''
+        The stack of default dbs, each with the settings given to as_default. It is kept per execution context
+        (see contextvars) : each thread and each asyncio task has its own
+        '''
+        self._stack = ContextVar('detl_db_stack', default=())
 
-        self.stack = []
+    @property
+    def stack(self):
+        return [db for db, _ in self._stack.get()]
 
     def get_db(self):
         # TODO : get default db from the config folder
-        return self.stack[-1] if len(self.stack) > 0 else None
+        stack = self._stack.get()
+        return stack[-1][0] if len(stack) > 0 else None
+
+    def get_settings(self, db):
+        '''The settings of the innermost context of db, empty outside of its contexts'''
+        for default, settings in reversed(self._stack.get()):
+            if default is db:
+                return settings
+        return {}
 
     @contextmanager
-    def get_controller(self, default):
+    def get_controller(self, default, **settings):
         """A context manager for manipulating a stack."""
+        self._stack.set(self._stack.get() + ((default, settings),))
         try:
-            self.stack.append(default)
             yield default
         finally:
-            if self.stack:
-                if self.stack[-1] is not default:
-                    raise AssertionError(
+            stack = self._stack.get()
+            if not stack or stack[-1][0] is not default:
+                raise AssertionError(
                     "Nesting violated for default stack of %s objects" %
                     type(default))
-                    self.stack.pop()
-                else:
-                    self.stack.remove(default)
+            self._stack.set(stack[:-1])
+
+    def snapshot(self):
+        '''
+        The stack, to be restored in a worker process (see restore). The dbs are pickled, the workers run the
+        computations one after the other and write the results synchronously
+        '''
+        return tuple((db, {'lazy': settings.get('lazy', False), 'policy': settings.get('policy')})
+                     for db, settings in self._stack.get())
+
+    @contextmanager
+    def restore(self, snapshot):
+        token = self._stack.set(snapshot)
+        try:
+            yield
+        finally:
+            self._stack.reset(token)
+
+
+def submit_in_context(pool, fn, *args, **kwargs):
+    '''Submit a task to a pool of threads, the task runs with a copy of the current default dbs'''
+    return pool.submit(copy_context().run, fn, *args, **kwargs)
 
 db_context = DbStack()
@@ -0,0 +1,162 @@
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from detl.wrapper import Wrapper, _NOT_CACHED, _fn_reference, _resolve_fn
+from detl.db_context import db_context, submit_in_context
+from detl import trace
+
+EXECUTORS = ('serial', 'thread', 'process')
+
+
+def execute(db, nodes, wrappers, executor=None, max_workers=None, pool=None):
+    '''
+    Get the data of the nodes of a graph (see graph) with an executor, and return the data of the wrappers.
+    The dependencies that are not in the graph are not needed. The independent nodes are run concurrently
+    by the executor :
+        'serial' : one after the other, in topological order
+        'thread' : the whole load / compute / insert of a node runs in a thread pool
+        'process' : the functions run in a process pool, the lookups, loads and inserts stay in this process
+    By default, the executor set with db.as_default(executor=...) is used. A pool of the executor can be
+    given to reuse it for several graphs
+    '''
+    executor = executor or db.executor or 'serial'
+    if executor not in EXECUTORS:
+        raise ValueError('Unknown executor %s, expected one of %s' % (executor, EXECUTORS))
+    max_workers = max_workers or db.max_workers
+
+    if executor == 'serial':
+        for node in nodes.values():
+            if node._data is None:
+                node._get_data(db)
+    else:
+        _run(db, nodes, executor, max_workers, pool=pool)
+
+    # Wrappers with the same identity as a node of the graph share its data
+    results = []
+    for wrapper in wrappers:
+        wrapper._data = nodes[wrapper.__id_hash__()]._data
+        results.append(wrapper._data)
+    return results
+
+
+def graph(wrappers, expand=None):
+    '''
+    The wrappers needed to compute the data of wrappers, keyed by identity hash in topological order
+    (dependencies first). The dependencies of a node are only included if expand(node) is true, by default
+    if its data is not available
+    '''
+    if expand is None:
+        expand = lambda node: node._data is None
+
+    nodes = {}
+    seen = set()
+    stack = [(wrapper, False) for wrapper in reversed(wrappers)]
+    while stack:
+        node, expanded = stack.pop()
+        hash_value = node.__id_hash__()
+        if expanded:
+            nodes[hash_value] = node
+            continue
+        if hash_value in seen:
+            continue
+        seen.add(hash_value)
+        stack.append((node, True))
+        if expand(node):
+            stack.extend((dep, False) for dep in reversed(node.dependencies()))
+    return nodes
+
+
+def _run(db, nodes, executor, max_workers, pool=None):
+    '''Run the nodes of the graph whose dependencies are available, as soon as they are'''
+    if pool is None:
+        pool_cls = ThreadPoolExecutor if executor == 'thread' else ProcessPoolExecutor
+        with pool_cls(max_workers) as pool:
+            return _run(db, nodes, executor, max_workers, pool=pool)
+
+    waiting = {}
+    dependents = defaultdict(list)
+    for hash_value, node in nodes.items():
+        if node._data is not None:
+            continue
+        deps = {dep.__id_hash__() for dep in node.dependencies()}
+        deps = {dep for dep in deps if dep in nodes and nodes[dep]._data is None}
+        waiting[hash_value] = deps
+        for dep in deps:
+            dependents[dep].append(hash_value)
+
+    ready = [hash_value for hash_value, deps in waiting.items() if not deps]
+    running = {}
+    try:
+        while ready or running:
+            for hash_value in ready:
+                running[_submit(db, pool, nodes[hash_value], executor)] = hash_value
+            ready = []
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                hash_value = running.pop(future)
+                computed, results, compute_time = future.result()
+                if computed:
+                    node = nodes[hash_value]
+                    node.compute_time = compute_time
+                    if trace.hooks:
+                        # Measured by the worker process, the span ends when the result is received
+                        now = time.perf_counter()
+                        trace.record('compute', node.identity, now - compute_time, now,
+                                     deps=[dep.__id_hash__() for dep in node.dependencies()])
+                    node._store(db, results)
+                for dependent in dependents[hash_value]:
+                    waiting[dependent].discard(hash_value)
+                    if not waiting[dependent]:
+                        ready.append(dependent)
+    except BaseException:
+        for future in running:
+            future.cancel()
+        raise
+
+
+def _submit(db, pool, node, executor):
+    '''
+    Start loading or computing a node. The future returns (computed, results, compute_time) where computed
+    tells whether the results still have to be inserted to the db
+    '''
+    if executor == 'thread':
+        return submit_in_context(pool, _get_data, node, db)
+
+    results = node._load(db)
+    if results is not _NOT_CACHED:
+        future = Future()
+        future.set_result((False, results, None))
+        return future
+
+    args = [_get_available_data(arg, db) for arg in node.args]
+    kwargs = {k: _get_available_data(v, db) for k, v in node.kwargs.items()}
+    return pool.submit(_call, _fn_reference(node.fn), args, kwargs, db_context.snapshot())
+
+
+def _get_data(node, db):
+    return False, node._get_data(db), None
+
+
+def _get_available_data(obj, db):
+    '''
+    The data of an argument. The dependencies of a result planned to be loaded are not in the graph, they are
+    loaded or computed in this process if the result could not be loaded, e.g. if its file was deleted
+    '''
+    if not isinstance(obj, Wrapper):
+        return obj
+    if obj._data is None:
+        execute(db, graph([obj]), [obj], executor='serial')
+    return obj._data
+
+
+def _call(fn_ref, args, kwargs, snapshot=()):
+    '''
+    Run in the worker processes : the undecorated function is called on the data, with the default dbs of
+    the process that submitted it, for the identified computations it runs itself
+    '''
+    fn = _resolve_fn(fn_ref)
+    with db_context.restore(snapshot):
+        start = time.perf_counter()
+        results = fn(*args, **kwargs)
+        return True, results, time.perf_counter() - start
@@ -0,0 +1,119 @@
+import hashlib
+import os
+import pickle
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Size of the chunks of a buffer hashed separately
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# The threads hashing the chunks, created on first use. hashlib releases the GIL on large buffers
+_pool = None
+_pool_lock = threading.Lock()
+
+# The fingerprints of the read only arrays, by id, with a weak reference to the array
+_memo = {}
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(min(32, os.cpu_count() or 1), thread_name_prefix='detl-fingerprint')
+        return _pool
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def array_fingerprint(arr):
+    '''
+    The fingerprint of an array, from its dtype, its shape and its content. The memory buffer is hashed by
+    chunks of CHUNK_SIZE bytes in a thread pool, without copy if the array is C contiguous. The fingerprint
+    of a read only array (e.g. a memory mapped result) is computed once, the other arrays can be modified
+    in place so they are hashed every time
+    '''
+    frozen = _is_frozen(arr)
+    if frozen:
+        memo = _memo.get(id(arr))
+        if memo is not None and memo[0]() is arr:
+            return memo[1]
+
+    header = pickle.dumps((str(arr.dtype.descr), arr.shape))
+    if arr.dtype.hasobject:
+        digests = [_digest(pickle.dumps(arr, protocol=pickle.HIGHEST_PROTOCOL))]
+    else:
+        digests = _chunk_digests(arr.reshape(1) if arr.ndim == 0 else arr)
+    fingerprint = hashlib.blake2b(header + b''.join(digests), digest_size=16).hexdigest()
+
+    if frozen:
+        key = id(arr)
+        try:
+            ref = weakref.ref(arr, lambda _, key=key: _memo.pop(key, None))
+        except TypeError:
+            return fingerprint
+        _memo[key] = (ref, fingerprint)
+    return fingerprint
+
+
+def _chunk_digests(arr):
+    '''The digests of the chunks of rows of an array, the chunks that are not contiguous are copied'''
+    row_size = max(1, arr.nbytes // max(1, len(arr)))
+    rows = max(1, CHUNK_SIZE // row_size)
+    chunks = [arr[i:i + rows] for i in range(0, max(1, len(arr)), rows)]
+
+    def chunk_digest(chunk):
+        return _digest(np.ascontiguousarray(chunk).reshape(-1).view(np.uint8))
+
+    if len(chunks) == 1:
+        return [chunk_digest(chunks[0])]
+    return list(_get_pool().map(chunk_digest, chunks))
+
+
+def _is_frozen(arr):
+    '''Whether an array and the arrays it is a view of are read only'''
+    while isinstance(arr, np.ndarray):
+        if arr.flags.writeable:
+            return False
+        arr = arr.base
+    return True
+
+
+def series_fingerprint(series, with_index=True):
+    '''The fingerprint of a Series from its values, dtype, name and index'''
+    parts = [str(series.dtype), repr(series.name), _values_fingerprint(series)]
+    if with_index:
+        parts.append(index_fingerprint(series.index))
+    return _combine(parts)
+
+
+def frame_fingerprint(df):
+    '''The fingerprint of a DataFrame from the fingerprints of its columns, its column labels and its index'''
+    parts = [repr(list(df.columns)), index_fingerprint(df.index)]
+    parts += [series_fingerprint(df.iloc[:, i], with_index=False) for i in range(df.shape[1])]
+    return _combine(parts)
+
+
+def index_fingerprint(index):
+    import pandas as pd
+
+    if isinstance(index, pd.RangeIndex):
+        return _combine(['range', repr((index.start, index.stop, index.step)), repr(index.name)])
+    return _combine([type(index).__name__, repr(index.names), _values_fingerprint(index)])
+
+
+def _values_fingerprint(values):
+    '''The values of a Series or an Index, the ones that are not a numpy array are hashed by pandas'''
+    import pandas as pd
+
+    arr = values.to_numpy() if isinstance(values.dtype, np.dtype) else None
+    if arr is None or arr.dtype.hasobject:
+        arr = pd.util.hash_pandas_object(values, index=False).to_numpy()
+    return array_fingerprint(arr)
+
+
+def _combine(parts):
+    return hashlib.blake2b('\0'.join(parts).encode(), digest_size=16).hexdigest()
@@ -4,14 +4,15 @@ import hashlib
 import copy
 from functools import singledispatch, partial
 from detl.db_context import db_context
-from bson.objectid import ObjectId
 from bson.json_util import dumps, loads
 from inspect import getmodule
+import numpy as np
+from detl.fingerprint import array_fingerprint, series_fingerprint, frame_fingerprint
+from detl import trace
 
 def h11(text):
-    '''The hash used for the serialized configurations'''
-    b = hashlib.md5(text.encode()).hexdigest()[:9]
-    return int(b, 16)
+    '''The hash used for the serialized configurations : a 128 bits blake2b digest, as an hex string'''
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
 
 class Identity(object):
 
@@ -30,17 +31,60 @@ class Identity(object):
         self.load_dict = {'fn_name': load_fn.__name__,
                 'fn_module': getmodule(load_fn).__name__} if load_fn else None
         self.load_fn = load_fn
+
+        # Computed on first use, see __id_hash__
+        self._id_hash = None
+        # The serialized arguments with the arguments, by id, see _serialize
+        self._serialized = {}
+        # The object ids of the metadata documents by db token, known once they have been found in or inserted
+        # to each db
+        self.obj_ids = {}
         
-    def __id_hash__(self, obj=None):
+    def __id_hash__(self):
         '''
-        Identity is based on name and hash of arguments
+        Identity is based on name and hash of arguments. Identified arguments are replaced by their own
+        (cached) hash, so that the hash of a node is derived from the hashes of its parents, Merkle-style
         '''
-        # TODO : this is really awful
-        if obj is not self:
-            obj = self
-
+        if self._id_hash is None:
+            # The ancestors that are not hashed yet are hashed first, so that deep graphs are not hashed recursively
+            for ident in self._unhashed_ancestors():
+                if not trace.hooks:
+                    ident._id_hash = ident._hash()
+                else:
+                    with trace.span('hash', ident) as span:
+                        ident._id_hash = span.hash = ident._hash()
+        return self._id_hash
+
+    def _unhashed_ancestors(self):
+        '''This identity and its ancestors whose hash is not computed yet, the parents before their children'''
+        order = []
+        seen = set()
+        stack = [(self, False)]
+        while stack:
+            ident, expanded = stack.pop()
+            if expanded:
+                order.append(ident)
+                continue
+            if ident._id_hash is not None or id(ident) in seen:
+                continue
+            seen.add(id(ident))
+            stack.append((ident, True))
+            stack.extend((parent, False) for _, parent in ident.parent_identities())
+        return order
+
+    def _hash(self):
         id_dict = {'name' : self.name, 'args' : self.args, 'kwargs' : self.kwargs, 'load_fn':self.load_dict, 'save_fn': self.save_dict}
-        return h11(json.dumps(id_dict, sort_keys=True, default=to_serializable ))
+        return h11(json.dumps(id_dict, sort_keys=True, default=self._serialize))
+
+    def _serialize(self, val):
+        '''
+        to_serializable, computed once per argument : the fingerprints of the large arrays and pandas objects
+        computed for the hash are reused when the configuration is inserted
+        '''
+        cached = self._serialized.get(id(val))
+        if cached is None or cached[0] is not val:
+            cached = self._serialized[id(val)] = (val, to_serializable(val))
+        return cached[1]
 
     def to_dict(self, db=None):
         '''Create a serializable version of the configuration'''
@@ -51,13 +95,30 @@ class Identity(object):
                 'load_fn' : self.load_dict,
                 'save_fn' : self.save_dict}
 
-        serialized_dict = json.dumps(base_dict, default=to_serializable)
+        serialized_dict = json.dumps(base_dict, default=self._serialize)
         reloaded_dict = json.loads(serialized_dict)
-        reloaded_dict['args'] = [to_obj_id(el, db=db) for el in reloaded_dict['args']]
-        reloaded_dict['kwargs'] = {k:to_obj_id(val, db=db) for k, val in reloaded_dict['kwargs'].items()}
+
+        # Replace the identified arguments by the object id of their metadata, all resolved at once
+        if db is not None:
+            parents = self.parent_identities()
+            obj_ids = db.find_obj_ids([ident for _, ident in parents])
+            for (key, _), obj_id in zip(parents, obj_ids):
+                if obj_id is None:
+                    continue
+                if type(key) is int:
+                    reloaded_dict['args'][key] = obj_id
+                else:
+                    reloaded_dict['kwargs'][key] = obj_id
+            reloaded_dict['parents'] = list(dict.fromkeys(obj_id for obj_id in obj_ids if obj_id is not None))
 
         return reloaded_dict 
 
+    def parent_identities(self):
+        '''The identities of the identified arguments as a list of (position or keyword, identity)'''
+        parents = [(i, get_identity(arg)) for i, arg in enumerate(self.args)]
+        parents += [(k, get_identity(v)) for k, v in self.kwargs.items()]
+        return [(key, ident) for key, ident in parents if ident is not None]
+
     @classmethod
     def from_dict(cls, conf_dict):
         wrap = Identity(None, [], {})
@@ -66,6 +127,8 @@ class Identity(object):
         wrap.kwargs = conf_dict['kwargs']
         wrap.load_dict = conf_dict['load_fn']
         wrap.save_dict = conf_dict['save_fn']
+        # The parents are stored as object ids, the hash cannot be computed again from the dict
+        wrap._id_hash = conf_dict['config_hash']
 
         return wrap
 
@@ -75,12 +138,37 @@ def to_serializable(val, db = None):
     hash_val = val.__id_hash__()
     return hash_val
 
-def to_obj_id(hash_val, db=None):
-    if db is not None:
-        res = db.find_from_hash(hash_val)
-        if res is not None:
-            return ObjectId(res['_id'])
-    return hash_val
+# The arrays and the pandas objects are identified by the content of their memory buffers, see detl.fingerprint
+@to_serializable.register(np.ndarray)
+def _(val, db=None):
+    return array_fingerprint(val)
+
+@to_serializable.register(np.generic)
+def _(val, db=None):
+    return val.item()
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+if pd is not None:
+    @to_serializable.register(pd.Series)
+    def _(val, db=None):
+        return series_fingerprint(val)
+
+    @to_serializable.register(pd.DataFrame)
+    def _(val, db=None):
+        return frame_fingerprint(val)
+
+def get_identity(obj):
+    '''The identity of an identified object (Wrapper, Processor or Identity), None otherwise'''
+    if isinstance(obj, Identity):
+        return obj
+    ident = getattr(obj, 'identity', None)
+    if isinstance(ident, Identity):
+        return ident
+    return None
 
 
 class SourceIdentity(Identity):
@@ -92,8 +180,7 @@ class SourceIdentity(Identity):
         # TODO : check if bsonable
         self.identifier = identifier
 
-    def __id_hash__(self):
-        
+    def _hash(self):
         return h11(self.identifier)
 
 
@@ -1,63 +1,315 @@
-import datetime
 import os
-import pymongo
 import hashlib
-from pymongo import MongoClient
 from bson.objectid import ObjectId
 from detl.db_context import db_context
 import json
 import logging
-from detl.identity import Identity
+from detl.identity import h11
+from bson.json_util import dumps
+from detl.cache import LRUCache, result_cache
+from detl.backends import MongoBackend, backend_from_config, parent_ids
+from detl.serializers import save_auto, save_outputs
+from detl.collector import GarbageCollector
+from detl.store import ArtifactStore, store_from_config
+from detl.writer import Writer
+from detl.policy import io_model
+from detl import trace
+from contextlib import contextmanager
+import time
+import uuid
+import weakref
+
+# Marks a lookup that the metadata cache cannot answer
+_MISSING = object()
+
+# The fields of the metadata needed to load a result
+FILE_PROJECTION = {'file_descriptor': 1, 'artifact': 1, 'load_time': 1}
+
+
+def fingerprint(*parts):
+    '''The fingerprint of a function name, or of a keyword argument (with or without function name)'''
+    return h11(dumps(parts, sort_keys=True))
+
+
+def node_fingerprints(doc):
+    '''
+    The fingerprints of a metadata document : its name, and each of its keyword arguments with and without
+    the name. The identified arguments are not fingerprinted, they are ancestors
+    '''
+    fingerprints = [fingerprint(doc['name'])]
+    for key, value in doc.get('kwargs', {}).items():
+        if type(value) is not ObjectId:
+            fingerprints += [fingerprint(None, key, value), fingerprint(doc['name'], key, value)]
+    return fingerprints
+
+# The dbs created by db_client and the version of their config file, by path
+_config_dbs = {}
+
 
 def db_client(config_path='configs/db.json'):
+    '''The db of a config file, created once per process until the file is modified'''
+    stat = os.stat(config_path)
+    path, version = os.path.realpath(config_path), (stat.st_mtime_ns, stat.st_size)
+    if path in _config_dbs and _config_dbs[path][0] == version:
+        return _config_dbs[path][1]
 
     with open(config_path) as fd:
         config = json.load(fd)
 
-    host = config['host']
-    port = config['port']
-    db = config['db']
-    collection = config['collection']
     data_folder = config['data_folder']
 
-    return MyDb(host, port, db, collection, data_folder)
+    db = MyDb(data_folder=data_folder, backend=backend_from_config(config), store=store_from_config(config))
+    _config_dbs[path] = (version, db)
+    return db
 
 
-class MyDb(object):
+# The dbs received by this worker process, by token
+_restored_dbs = weakref.WeakValueDictionary()
+
+
+def _restore_db(token, backend, data_folder, store, cache_size):
+    db = _restored_dbs.get(token)
+    if db is None:
+        db = MyDb(data_folder=data_folder, cache_size=cache_size, backend=backend, store=store)
+        db.token = token
+        _restored_dbs[token] = db
+    return db
+
 
-    def __init__(self, host, port, db, collection, data_folder):
+class MyDb(object):
 
-        self.client = MongoClient(host, port)
-        self.db = getattr(self.client, db)
-        self.coll = getattr(self.db, collection)
+    def __init__(self, host=None, port=None, db=None, collection=None, data_folder=None, cache_size=10000,
+                 memory_budget=None, backend=None, store=None):
+        '''
+        The metadata of the results and the folder where they are saved. The metadata is stored by the
+        backend (see detl.backends), a mongo collection by default. The results are saved in the artifact
+        store (see detl.store), by default in the data folder only
+        '''
+        self.backend = backend if backend is not None else MongoBackend(host, port, db, collection)
     
         self.data_folder = data_folder
+        # The saved results, named by their content
+        if store is None and data_folder is not None:
+            store = ArtifactStore(data_folder)
+        self.store = store
+
+        # Metadata documents keyed by config hash and by object id, None for the hashes known to be absent
+        self.meta_cache = LRUCache(cache_size)
+
+        # Memory budget of the process-wide result cache while this db is the default, in bytes (see as_default)
+        self.memory_budget = memory_budget
 
-        # TODO : in the future, split the find into two cases : whether the file is available or not (in that case, can download)
+        # The collection in progress, see collect_garbage
+        self._collector = None
 
-    def find(self, identity):
+        # Identifies the db when it is sent to worker processes, see __reduce__
+        self.token = uuid.uuid4().hex
 
+        self.ensure_indexes()
+
+    def __reduce__(self):
+        '''
+        The dbs are sent to the worker processes (see detl.db_context.DbStack.snapshot) as their backend and
+        store, each worker creates the db once
+        '''
+        return _restore_db, (self.token, self.backend, self.data_folder, self.store, self.meta_cache.maxsize)
+
+    # How the graphs of wrappers are run in the current context, see as_default, detl.executor.execute and
+    # detl.planner.Plan
+    @property
+    def executor(self):
+        return db_context.get_settings(self).get('executor')
+
+    @property
+    def policy(self):
+        return db_context.get_settings(self).get('policy')
+
+    @property
+    def max_workers(self):
+        return db_context.get_settings(self).get('max_workers')
+
+    @property
+    def lazy(self):
+        return db_context.get_settings(self).get('lazy', False)
+
+    @property
+    def writer(self):
+        '''The background writer in write behind mode'''
+        return db_context.get_settings(self).get('writer')
+
+    def ensure_indexes(self):
+        '''Create the indexes of the metadata if they do not exist yet'''
+        self.backend.ensure_indexes()
+
+    def migrate(self):
+        '''Migrate the metadata created by an older version of detl, see the migrate method of the backend'''
+        self.backend.migrate()
+        self.meta_cache.clear()
+        self.fill_closures()
+
+    def fill_closures(self):
+        '''Add the ancestor closure (see _add_closure) to the documents written without it'''
+        docs = {doc['_id']: doc for doc in self.backend.find({})}
+        # The closures are built from the oldest ancestors down
+        done = set()
+        for obj_id in docs:
+            stack = [obj_id]
+            while stack:
+                doc = docs[stack[-1]]
+                missing = [parent for parent in parent_ids(doc) if parent in docs and parent not in done]
+                if missing:
+                    stack.extend(missing)
+                    continue
+                stack.pop()
+                if doc['_id'] in done:
+                    continue
+                done.add(doc['_id'])
+                if 'fingerprints' not in doc:
+                    doc['parents'] = parent_ids(doc)
+                    self._add_closure(doc, [docs[parent] for parent in doc['parents'] if parent in docs])
+                    self.backend.insert(doc)
+        self.meta_cache.clear()
+
+    def _cache_get(self, key, projection=None):
+        '''
+        The cached metadata for a config hash or an object id (None if known to be absent), _MISSING if the
+        db has to be queried. An entry fetched with a projection only answers lookups for the same fields
+        '''
+        def covers(entry):
+            doc, fields = entry
+            return doc is None or fields is None or (projection is not None and set(projection) <= fields)
+
+        entry = self.meta_cache.get(key, accept=covers)
+        return _MISSING if entry is None else entry[0]
+
+    def _cache_put(self, hash_val, doc, projection=None):
+        '''Cache the metadata of a config hash (doc is None if absent), fetched with the given projection'''
+        fields = None if projection is None else frozenset(projection) | {'_id'}
+        if doc is not None and fields is not None:
+            previous = self.meta_cache.peek(hash_val)
+            if previous is not None and previous[0] is not None and previous[1] is None:
+                # Keep the full document
+                return
+        self.meta_cache.put(hash_val, (doc, fields))
+        if doc is not None:
+            self.meta_cache.put(doc['_id'], (doc, fields))
+
+    def cache_info(self):
+        '''Hit and miss counters of the metadata cache'''
+        return self.meta_cache.info()
+
+    def find(self, identity, projection=None):
+        '''The metadata of an identity, None if it is not in the db'''
+        if not trace.hooks:
+            return self._find(identity, projection)
+        with trace.span('find', identity) as span:
+            span.fields['cached'] = self.meta_cache.peek(identity.__id_hash__()) is not None
+            result = self._find(identity, projection)
+            span.fields['found'] = result is not None
+            return result
+
+    def _find(self, identity, projection=None):
         hash_value = identity.__id_hash__()
-        result = self.coll.find_one({'config_hash': hash_value})
+        result = self._cache_get(hash_value, projection)
+        if result is _MISSING:
+            result = self.backend.find_one(hash_value, projection)
+            self._cache_put(hash_value, result, projection)
+        if result is not None:
+            identity.obj_ids[self.token] = result['_id']
         return result
+
+    def exists(self, identity):
+        '''Whether the identity is in the db, without fetching its metadata'''
+        return self.find(identity, projection={'_id': 1}) is not None
     
     def find_from_hash(self, hash_val):
 
-        return self.coll.find_one({'config_hash': hash_val})
-
+        result = self._cache_get(hash_val)
+        if result is _MISSING:
+            result = self.backend.find_one(hash_val)
+            self._cache_put(hash_val, result)
+        return result
 
-    def find_file(self, identity, unpack_input=False, unpack_len=0):
-        if unpack_input:
-            all_identities = [Identity('unpack', [identity, i], {}) for i in range(unpack_len)]
-            return [self._find_file(all_identities[i]) for i in range(unpack_len)]
-        return self._find_file(identity)
+    def find_many(self, identities, projection=None):
+        '''
+        The metadata of several identities (None if not in the db). The ones that are not cached are
+        fetched in a single query
+        '''
+        if not trace.hooks:
+            return self._find_many(identities, projection)
+        with trace.span('find', count=len(identities)) as span:
+            results = self._find_many(identities, projection)
+            span.fields['found'] = sum(res is not None for res in results)
+            return results
+
+    def _find_many(self, identities, projection=None):
+        hashes = [ident.__id_hash__() for ident in identities]
+        found = {}
+        missing = set()
+        for hash_value in hashes:
+            cached = self._cache_get(hash_value, projection)
+            if cached is _MISSING:
+                missing.add(hash_value)
+            else:
+                found[hash_value] = cached
+
+        if missing:
+            query_projection = None if projection is None else dict(projection, config_hash=1)
+            for res in self.backend.find_many(missing, query_projection):
+                found[res['config_hash']] = res
+                self._cache_put(res['config_hash'], res, query_projection)
+            for hash_value in missing - found.keys():
+                found[hash_value] = None
+                self._cache_put(hash_value, None)
+
+        results = [found[hash_value] for hash_value in hashes]
+        for ident, res in zip(identities, results):
+            if res is not None:
+                ident.obj_ids[self.token] = res['_id']
+        return results
+
+    def find_obj_ids(self, identities):
+        '''
+        The object ids of the metadata of several identities in this db (None if not in the db). The ids
+        already known by the identities are reused and the others are resolved in a single query
+        '''
+        self.find_many([ident for ident in identities if self.token not in ident.obj_ids], projection={'_id': 1})
+        return [ident.obj_ids.get(self.token) for ident in identities]
 
-    def _find_file(self, identity):
+    def find_file(self, identity):
 
-        res = self.find(identity)
+        res = self.find(identity, projection=FILE_PROJECTION)
         if res is not None:
             if 'file_descriptor' in res:
-                return res['file_descriptor']
+                try:
+                    return self.local_file(res)
+                except FileNotFoundError:
+                    # The file was deleted, the result is computed again
+                    self.forget_files([identity.__id_hash__()])
+
+    def record_load(self, identity, seconds):
+        '''
+        Record the time it took to load a result, in its metadata the first time (see detl.policy). Returns the
+        size of its files
+        '''
+        res = self.find(identity, projection=FILE_PROJECTION)
+        if res is None:
+            return
+        size = res.get('artifact', {}).get('size')
+        io_model.record('read', size, seconds)
+        if 'load_time' not in res:
+            self.backend.set_fields(identity.__id_hash__(), {'load_time': seconds})
+            res['load_time'] = seconds
+        return size
+
+    def local_file(self, res):
+        '''
+        The local path of the file of a result. The results saved by other nodes are downloaded from the
+        remote store if they are not in the local cache (see detl.store.ArtifactStore.fetch)
+        '''
+        if 'artifact' in res and self.store is not None:
+            return self.store.fetch(res['artifact'], res['file_descriptor'])
+        return res['file_descriptor']
 
     
     def insert(self, results, save_func, save_data=True, unpack_input=False):
@@ -78,116 +330,313 @@ class MyDb(object):
             self._insert(wrapper.identity, None, save_func, save_data=save_data)
 
 
-    def _insert(self, identity, results, save_func, save_data=True):
-        
+    def _insert(self, identity, results, save_func, save_data=True, stats=None):
+        if not trace.hooks:
+            return self._insert_doc(identity, results, save_func, save_data=save_data, stats=stats)
+        with trace.span('insert', identity) as span:
+            obj_id = self._insert_doc(identity, results, save_func, save_data=save_data, stats=stats)
+            span.fields['bytes'] = self._saved_size(identity)
+            return obj_id
+
+    def _insert_doc(self, identity, results, save_func, save_data=True, stats=None):
+        identity_dict = self._metadata(identity, results, save_func, save_data=save_data, stats=stats)
+
+        # Save the metadata, replacing the previous metadata of the same configuration if any
+        obj_id = self.backend.insert(identity_dict)
+        self._cache_inserted(identity, identity_dict, obj_id)
+        return obj_id
+
+    def _saved_size(self, identity):
+        '''The size of the files of a result just inserted, None if it was not saved'''
+        entry = self.meta_cache.peek(identity.__id_hash__())
+        if entry is not None and entry[0] is not None:
+            return entry[0].get('artifact', {}).get('size')
+
+    def _insert_unpacked(self, identity, results, save_func, children, save_data=True, stats=None):
+        '''
+        Insert the results of a function with several outputs and the identities of its outputs (children). With
+        the default formats, the outputs are saved in a single packed file and each child loads only its own
+        slice. Otherwise each output is saved by save_func. The metadata of the children is written at once
+        '''
+        if not trace.hooks:
+            return self._insert_outputs(identity, results, save_func, children, save_data=save_data, stats=stats)
+        with trace.span('insert', identity, outputs=len(children)) as span:
+            self._insert_outputs(identity, results, save_func, children, save_data=save_data, stats=stats)
+            span.fields['bytes'] = self._saved_size(identity)
+
+    def _insert_outputs(self, identity, results, save_func, children, save_data=True, stats=None):
+        packed = save_func is save_auto
+        identity_dict = self._metadata(identity, results, save_outputs if packed else None, save_data=save_data,
+                                       stats=stats)
+        self._cache_inserted(identity, identity_dict, self.backend.insert(identity_dict))
+        fd = identity_dict.get('file_descriptor')
+
+        docs = []
+        for i, child in enumerate(children):
+            if packed and fd is not None:
+                doc = self._metadata(child, None, None)
+                doc.update(file_descriptor=fd, artifact=identity_dict['artifact'], format='packed', index=i)
+            else:
+                doc = self._metadata(child, results[i], save_func, save_data=save_data)
+            docs.append(doc)
+
+        for child, doc, obj_id in zip(children, docs, self.backend.insert_many(docs)):
+            self._cache_inserted(child, doc, obj_id)
+
+    def insert_sources(self, identities):
+        '''
+        Insert the metadata of results that are given rather than computed, e.g. the elements of a dataset
+        (see detl.dataset), so that they are the parents of the results computed from them. The ones already
+        in the db are skipped, the others are inserted at once
+        '''
+        found = self.find_many(identities, projection={'_id': 1})
+        missing = list({ident.__id_hash__(): ident for ident, res in zip(identities, found) if res is None}.values())
+        docs = [self._metadata(ident, None, None) for ident in missing]
+        for ident, doc, obj_id in zip(missing, docs, self.backend.insert_many(docs)):
+            self._cache_inserted(ident, doc, obj_id)
+
+    def _metadata(self, identity, results, save_func, save_data=True, stats=None):
+        '''
+        The metadata document of a result, which is saved if save_func is given. The stats measured when the
+        result was computed (see detl.policy) are recorded with the time it took to save it
+        '''
         # TODO : move to computation identity class
-        hash_value = identity.__id_hash__()
         identity_dict = identity.to_dict(db=self)
+        self._add_closure(identity_dict, self._find_ids(identity_dict['parents']))
+        if stats:
+            identity_dict.update(stats)
         
         # If save_data
         if save_data and (save_func is not None):
             # Create a file path
             file_path = self.create_fd(identity)
+            start = time.perf_counter()
             # TODO : handle errors
             # Save to file path
-            save_func(results, file_path)
+            saved = save_func(results, file_path)
             # Add to dict
             identity_dict['file_descriptor'] = file_path
+            # The save function can record the format and change the file descriptor, see detl.serializers
+            if isinstance(saved, dict):
+                identity_dict.update(saved)
+            # Move the saved files to their final path, given by their content
+            identity_dict['file_descriptor'], identity_dict['artifact'] = self.store.put(
+                file_path, identity_dict['file_descriptor'], identity_dict['config_hash'])
+            end = time.perf_counter()
+            if stats is not None:
+                identity_dict['save_time'] = end - start
+            io_model.record('write', identity_dict['artifact']['size'], end - start)
+            if trace.hooks:
+                trace.record('save', identity, start, end, bytes=identity_dict['artifact']['size'])
+        return identity_dict
+
+    def _cache_inserted(self, identity, identity_dict, obj_id):
+        hash_value = identity.__id_hash__()
+        identity.obj_ids[self.token] = obj_id
 
-        # Save to collection
-        post = self.coll.insert_one(identity_dict)
-        return post
+        # The metadata written is the whole document
+        previous = self.meta_cache.pop(hash_value)
+        if previous is not None and previous[0] is not None:
+            self.meta_cache.pop(previous[0]['_id'])
+            # The previous file of the configuration is not used by it anymore
+            fd = previous[0].get('file_descriptor')
+            if fd is not None and fd != identity_dict.get('file_descriptor') and self.store.owns(fd):
+                self.store.release(fd, hash_value)
+        identity_dict['_id'] = obj_id
+        self._cache_put(hash_value, identity_dict)
 
 
+    def _add_closure(self, doc, parents):
+        '''
+        Add to a metadata document the object ids of all its ancestors and the fingerprints (see node_fingerprints)
+        of itself and of all its ancestors, built from the closures of its parents. The ancestry queries are then
+        single indexed queries (see find_by_ancestors)
+        '''
+        ancestors = list(doc.get('parents', []))
+        fingerprints = node_fingerprints(doc)
+        for parent in parents:
+            ancestors += parent.get('ancestors', [])
+            fingerprints += parent.get('fingerprints', node_fingerprints(parent))
+        doc['ancestors'] = list(dict.fromkeys(ancestors))
+        doc['fingerprints'] = list(dict.fromkeys(fingerprints))
+
+    def find_by_ancestors(self, query=None, ancestor_kwargs=None, ancestor_names=()):
+        '''
+        The results matching a query that were computed with the given keyword arguments and functions anywhere
+        in their pipeline, e.g.
+            db.find_by_ancestors({'name': 'accuracy'}, {'kernel': 'poly', 'split.test_size': 0.3})
+        A keyword can be prefixed by the name of the function it is given to
+        '''
+        fingerprints = [fingerprint(name) for name in ancestor_names]
+        for key, value in (ancestor_kwargs or {}).items():
+            name, _, key = key.rpartition('.')
+            fingerprints.append(fingerprint(name or None, key, value))
+        return self.backend.find_by_fingerprints(query or {}, fingerprints)
+
+    def forget_files(self, hashes):
+        '''Keep the results of several config hashes identified but not stored, see detl.backends'''
+        hashes = list(hashes)
+        if not hashes:
+            return
+        self.backend.forget_files(hashes)
+        for hash_value in hashes:
+            entry = self.meta_cache.pop(hash_value)
+            if entry is not None and entry[0] is not None:
+                self.meta_cache.pop(entry[0]['_id'])
+
+    def collect_garbage(self, max_size=None, max_seconds=None, **kwargs):
+        '''
+        Delete the files of the data folder that are not needed anymore, and the results least worth keeping
+        until the stored results fit in max_size bytes, see detl.collector.GarbageCollector. With max_seconds,
+        the collection stops after max_seconds and the next calls resume it, with the settings it started with
+        '''
+        collector = self._collector
+        if collector is None:
+            collector = self._collector = GarbageCollector(self, max_size=max_size, **kwargs)
+        try:
+            stats = collector.collect(max_seconds)
+        except BaseException:
+            self._collector = None
+            raise
+        if stats['done']:
+            self._collector = None
+        return stats
+
     def create_fd(self, identity):
         '''
-        Save to a data folder whose name corresponds to the name of the identity
+        A temporary path where a result is saved, the files are then moved to the store (see detl.store)
         '''
-        # TODO : no global variable
-        # TODO : assuming that the data folder is already created
-        # TODO : move hash_value to identity init
-        hash_value = identity.__id_hash__()
-        folder = os.path.join(self.data_folder, identity.name)
-        if not os.path.exists(folder):
-            os.mkdir(folder)
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        fname = timestamp + str(hash_value)
-        file_path = os.path.join(folder, fname)
-        return file_path
-        
-    def as_default(self):
+        return self.store.temp_path()
 
-        return db_context.get_controller(self)
+    @contextmanager
+    def as_default(self, memory_budget=None, executor=None, max_workers=None, lazy=False, write_behind=False,
+                   policy=None):
+        '''
+        Use this db for the identified computations, with a memory budget in bytes for the result cache.
+        The executor ('serial', 'thread' or 'process') runs the independent computations concurrently.
+        In lazy mode, the data of a wrapper is obtained by planning its whole graph first (see detl.planner).
+        In write behind mode, the results are saved and inserted in the background (see detl.writer.Writer),
+        all of them are written when the context exits.
+        The policy ('persist', 'memory', 'recompute' or 'auto') decides whether the computed results are saved,
+        kept in memory or computed again, unless their function sets its own (see detl.policy).
+        The settings are kept per thread and asyncio task, and the nested contexts inherit the executor, the
+        policy and the writer. The result cache is shared by the whole process, and so is its memory budget :
+        it is not kept per context, a budget given here applies to all the threads and tasks until the context
+        exits, and the previous budget is then restored
+        '''
+        memory_budget = self.memory_budget if memory_budget is None else memory_budget
+        previous_budget = result_cache.maxsize
+        if memory_budget is not None:
+            result_cache.resize(memory_budget)
+        settings = dict(db_context.get_settings(self), lazy=lazy)
+        if executor is not None:
+            settings.update(executor=executor, max_workers=max_workers)
+        if policy is not None:
+            settings.update(policy=policy)
+        writer = None
+        if write_behind and settings.get('writer') is None:
+            writer = settings['writer'] = Writer()
+        try:
+            with db_context.get_controller(self, **settings) as db:
+                yield db
+        finally:
+            if memory_budget is not None:
+                result_cache.resize(previous_budget)
+            if writer is not None:
+                writer.close()
+
+    def write(self, wrapper, fn, *args, **kwargs):
+        '''
+        Save and insert a result with fn(*args, **kwargs), now or in the background in write behind mode,
+        after the results wrapper depends on
+        '''
+        if self.writer is None:
+            return fn(*args, **kwargs)
+        # The unpacked outputs are written with the result they are taken from, see MyDb._insert_unpacked
+        dependencies = [(dep if dep.index is None else dep.args[0]).__id_hash__() for dep in wrapper.dependencies()]
+        self.writer.submit(wrapper.__id_hash__(), dependencies, fn, *args, **kwargs)
+
+    def is_pending(self, hash_value):
+        '''Whether a result is being written in the background'''
+        return self.writer is not None and self.writer.is_pending(hash_value)
+
+    def wait_written(self, hashes):
+        '''Wait until the results being written in the background with the given hashes are written'''
+        if self.writer is not None:
+            self.writer.wait(hashes)
     
     def drop_all(self):
-        self.coll.drop()
+        self.backend.drop()
+        self.meta_cache.clear()
+        result_cache.clear()
 
     def list_results(self, fn_name):
-        return self.coll.find({'name': fn_name})
+        return self.backend.list_results(fn_name)
 
     def has_ancestor(self, obj, query):
-        query_results = list(self.coll.find(query))
-        if str(obj['_id']) in [str(res['_id']) for res in query_results]:
-            return True
-
-        for arg in obj['args']:
-            if type(arg) is ObjectId:
-                ancestor_path = self.has_ancestor(self.find_id(arg), query)
-                if ancestor_path:
-                    return True
-
-        for kw, kwar in obj['kwargs'].items():
-            print(kwar)
-            if type(kwar) is ObjectId:
-                ancestor_path = self.has_ancestor(self.find_id(kwar), query)
-                if ancestor_path:
-                    return True
-    
-        return False
+        '''Whether a result matches the query or has an ancestor matching it'''
+        return len(self.filter_by_ancestor([obj], query)) > 0
 
+    def filter_by_ancestor(self, results, query):
+        '''
+        The results (metadata documents) that match a query or have an ancestor matching it, e.g. all the
+        accuracies computed with a poly kernel. The lineage of all the results is queried at once
+        '''
+        results = list(results)
+        matching = set(self.backend.filter_by_ancestor([res['_id'] for res in results], query))
+        return [res for res in results if res['_id'] in matching]
 
     def recursive_get(self, res_metadata):
-        
-        full_metadata = {'_id': res_metadata['_id'], 'config_hash': res_metadata['config_hash'],
-                'args': [], 'kwargs': {}, 'name': res_metadata['name']}
-
-        for arg in res_metadata['args']:
-            if type(arg) is ObjectId:
-                arg_metadata = self.find_id(arg)
-                full_metadata['args'].append(self.recursive_get(arg_metadata))
-
-        for kw, kwar in res_metadata['kwargs'].items():
-            if type(kwar) is ObjectId:
-                kw_metadata = self.find_id(kwar)
-                full_metadata['kwargs'][kw] = self.recursive_get(kw_metadata)
-            else:
-                full_metadata['kwargs'][kw] = kwar
-    
-        return full_metadata
+        '''The metadata of a result where the parents are replaced by their own (recursive) metadata'''
+        lineage = self.backend.lineage([res_metadata['_id']])[res_metadata['_id']]
+        docs = {doc['_id']: doc for doc in self.backend.find_ids(lineage)}
+        docs[res_metadata['_id']] = res_metadata
+        return _recursive_get(res_metadata, docs)
+
+    def _find_ids(self, obj_ids):
+        '''The metadata of several object ids, the ones that are not cached are fetched in a single query'''
+        found = {}
+        missing = []
+        for obj_id in obj_ids:
+            cached = self._cache_get(obj_id)
+            if cached is _MISSING:
+                missing.append(obj_id)
+            elif cached is not None:
+                found[obj_id] = cached
+        if missing:
+            for res in self.backend.find_ids(missing):
+                found[res['_id']] = res
+                self._cache_put(res['config_hash'], res)
+        return [found[obj_id] for obj_id in obj_ids if obj_id in found]
 
     def find_id(self, obj_id):
-        return self.coll.find_one({'_id': obj_id})
-'''
-db.test_pipeline.aggregate(
-
-{"$graphLookup": {"f rom": "test_pipeline",
-"startWith": "$args",
-"connectFromField": "args",
-"connectToField" : "_id",
-"as": "ancestors"}},
-{"$match": {"name": "processor_2"}},
-{ "$addFields": { 
-            "ancestors": { 
-                "$reverseArray": { 
-                    "$map": { 
-                        "input": "$ancestors", 
-                        "as": "t", 
-                        "in": { "name": "$$t.name" }
-                    } 
-                } 
-            }
-        }}];
+        result = self._cache_get(obj_id)
+        if result is _MISSING:
+            result = self.backend.find_id(obj_id)
+            if result is not None:
+                self._cache_put(result['config_hash'], result)
+        return result
+
+
+def _recursive_get(res_metadata, docs):
+    '''Build the metadata tree of a result from the documents of its ancestors'''
+    full_metadata = {'_id': res_metadata['_id'], 'config_hash': res_metadata['config_hash'],
+            'args': [], 'kwargs': {}, 'name': res_metadata['name']}
 
+    for arg in res_metadata['args']:
+        if type(arg) is ObjectId:
+            full_metadata['args'].append(_recursive_get(docs[arg], docs))
+
+    for kw, kwar in res_metadata['kwargs'].items():
+        if type(kwar) is ObjectId:
+            full_metadata['kwargs'][kw] = _recursive_get(docs[kwar], docs)
+        else:
+            full_metadata['kwargs'][kw] = kwar
+
+    return full_metadata
+
+
+'''
 Interface : 
 
 all_res = db.list_results('confusion_matrix')
@@ -0,0 +1,135 @@
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+from detl.db_context import db_context, submit_in_context
+from detl.cache import result_cache
+from detl.executor import graph, execute
+from detl.wrapper import _NOT_CACHED
+from detl.mydb import FILE_PROJECTION
+
+# Number of threads loading the saved results
+DEFAULT_IO_WORKERS = 8
+
+MEMORY = 'memory'
+LOAD = 'load'
+COMPUTE = 'compute'
+
+
+class Plan(object):
+
+    def __init__(self, wrappers, db=None):
+        '''
+        The execution plan of the data of several wrappers. All the nodes of their graph are looked up at once,
+        the nodes whose result is in memory or on disk are not expanded, so their ancestors are neither
+        computed nor loaded, and the identical subgraphs are merged
+        '''
+        self.wrappers = list(wrappers)
+        self.db = db or db_context.get_db()
+        if self.db is None:
+            raise ValueError('No db, cannot plan the computations')
+
+        full_graph = graph(self.wrappers)
+
+        # Look up all the nodes that are not in memory in a single query
+        self.status = {}
+        self.file_descriptors = {}
+        self.queries = 0
+        to_find = []
+        for hash_value, node in full_graph.items():
+            if node._data is not None or result_cache.peek(node._cache_key(self.db), _NOT_CACHED) is not _NOT_CACHED:
+                self.status[hash_value] = MEMORY
+            else:
+                to_find.append(node)
+        if to_find:
+            self.queries += 1
+            # The results being written in the background are inserted first
+            self.db.wait_written([node.__id_hash__() for node in to_find])
+        metadata = self.db.find_many([node.identity for node in to_find], projection=FILE_PROJECTION)
+        for node, res in zip(to_find, metadata):
+            self._set_file_descriptor(node.__id_hash__(), None if res is None else res.get('file_descriptor'))
+
+        self.pruned = len(full_graph)
+        self.nodes = graph(self.wrappers, expand=lambda node: self.status[node.__id_hash__()] == COMPUTE)
+        self.pruned -= len(self.nodes)
+
+    def _set_file_descriptor(self, hash_value, fd):
+        if fd is None:
+            self.status[hash_value] = COMPUTE
+        else:
+            self.status[hash_value] = LOAD
+            self.file_descriptors[hash_value] = fd
+
+    def nodes_with_status(self, status):
+        return [node for hash_value, node in self.nodes.items() if self.status[hash_value] == status]
+
+    def load_size(self):
+        '''Estimated number of bytes read from disk'''
+        return sum(file_size(self.file_descriptors[node.__id_hash__()]) for node in self.nodes_with_status(LOAD))
+
+    def explain(self):
+        '''A description of the plan, one line per node, and of the estimated I/O'''
+        computed = self.nodes_with_status(COMPUTE)
+        lines = ['Plan for %d wrappers : %d to compute, %d to load, %d in memory, %d pruned' % (
+            len(self.wrappers), len(computed), len(self.nodes_with_status(LOAD)),
+            len(self.nodes_with_status(MEMORY)), self.pruned)]
+
+        for hash_value, node in self.nodes.items():
+            status = self.status[hash_value]
+            line = '  %-8s %s %s' % (status, node.identity.name, hash_value[:12])
+            if status == LOAD:
+                fd = self.file_descriptors[hash_value]
+                line += ' from %s (%s)' % (fd, format_size(file_size(fd)))
+            elif status == COMPUTE:
+                deps = [dep.__id_hash__()[:12] for dep in node.dependencies()]
+                if deps:
+                    line += ' <- ' + ', '.join(deps)
+            lines.append(line)
+
+        # The unpacked outputs are written with the result they are taken from
+        written = [node for node in computed if node.save_fn is not None and node.index is None]
+        lines.append('Estimated I/O : at most %d metadata queries, %s read, %d results written' % (
+            self.queries, format_size(self.load_size()), len(written)))
+        return '\n'.join(lines)
+
+    def execute(self, executor=None, max_workers=None, io_workers=DEFAULT_IO_WORKERS, pool=None):
+        '''
+        Load or compute the nodes of the plan and return the data of the wrappers. The saved results are
+        loaded first by a pool of io_workers threads, then the others are computed by the executor (see
+        detl.executor.execute)
+        '''
+        to_load = self.nodes_with_status(LOAD)
+        if len(to_load) > 1 and io_workers > 1:
+            with ThreadPoolExecutor(io_workers) as io_pool:
+                futures = [submit_in_context(io_pool, node._load, self.db) for node in to_load]
+                for future in futures:
+                    future.result()
+        return execute(self.db, self.nodes, self.wrappers, executor=executor, max_workers=max_workers, pool=pool)
+
+
+def materialize(wrappers, executor=None, max_workers=None, io_workers=DEFAULT_IO_WORKERS):
+    '''
+    Load or compute the data of several wrappers and of all the wrappers they depend on, and return it
+    in the same order. The whole graph is looked up in a single query, the saved results are loaded
+    concurrently and the others computed by the executor (see detl.executor.execute)
+    '''
+    wrappers = list(wrappers)
+    db = db_context.get_db()
+    if db is None:
+        return [wrapper.data for wrapper in wrappers]
+
+    return Plan(wrappers, db).execute(executor=executor, max_workers=max_workers, io_workers=io_workers)
+
+
+def file_size(fd):
+    '''The size of a saved result. The save functions may add an extension to the file descriptor'''
+    if os.path.exists(fd):
+        return os.path.getsize(fd)
+    return sum(os.path.getsize(path) for path in glob.glob(glob.escape(fd) + '.*'))
+
+
+def format_size(num_bytes):
+    for unit in ['B', 'kB', 'MB', 'GB']:
+        if num_bytes < 1000:
+            return '%.1f %s' % (num_bytes, unit)
+        num_bytes /= 1000
+    return '%.1f TB' % num_bytes
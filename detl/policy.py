@@ -0,0 +1,77 @@
+import threading
+
+# How a computed result is kept :
+#   'persist' : saved, and loaded by the next runs
+#   'memory' : kept in the result cache of the process only, computed again by the next runs
+#   'recompute' : not kept, computed again whenever it is needed
+#   'auto' : saved if loading it is faster than computing it, in memory otherwise (see decide)
+PERSIST = 'persist'
+MEMORY = 'memory'
+RECOMPUTE = 'recompute'
+AUTO = 'auto'
+POLICIES = (PERSIST, MEMORY, RECOMPUTE, AUTO)
+
+# Initial estimates of the time to save or load a result : a fixed time per result (opening the files and
+# writing the metadata) and the throughput in bytes per second, refined by the measured times (see IoModel)
+DEFAULT_LATENCY = 0.002
+DEFAULT_READ_THROUGHPUT = 500 * 1024 * 1024
+DEFAULT_WRITE_THROUGHPUT = 200 * 1024 * 1024
+# The results smaller than this size measure the fixed time, the larger ones the throughput
+SMALL_SIZE = 64 * 1024
+# Weight of a new measure in the estimates
+SMOOTHING = 0.2
+
+
+class IoModel(object):
+
+    def __init__(self, latency=DEFAULT_LATENCY, read_throughput=DEFAULT_READ_THROUGHPUT,
+                 write_throughput=DEFAULT_WRITE_THROUGHPUT):
+        '''
+        Estimates the time to load and save a result from its size, as a fixed time plus the size over the
+        throughput. The estimates follow the times measured by the process
+        '''
+        self.latency = {'read': latency, 'write': latency}
+        self.throughput = {'read': read_throughput, 'write': write_throughput}
+        self._lock = threading.Lock()
+
+    def estimate(self, kind, size):
+        return self.latency[kind] + size / self.throughput[kind]
+
+    def load_time(self, size):
+        return self.estimate('read', size)
+
+    def save_time(self, size):
+        return self.estimate('write', size)
+
+    def record(self, kind, size, seconds):
+        '''A measured load ('read') or save ('write') of size bytes'''
+        if size is None or seconds <= 0:
+            return
+        with self._lock:
+            if size < SMALL_SIZE:
+                self.latency[kind] += SMOOTHING * (seconds - self.latency[kind])
+            else:
+                throughput = size / max(seconds - self.latency[kind], seconds / 2)
+                self.throughput[kind] += SMOOTHING * (throughput - self.throughput[kind])
+
+
+# The estimates of the process, shared by all the dbs
+io_model = IoModel()
+
+
+def decide(policy, compute_time, size):
+    '''
+    How to keep a result computed in compute_time seconds, of size bytes in memory. In auto mode, it is saved if
+    computing it again takes longer than saving and loading it, so that the saving pays off from the first run
+    that needs it again
+    '''
+    if policy is None:
+        return PERSIST
+    if policy not in POLICIES:
+        raise ValueError('Unknown policy %s, expected one of %s' % (policy, POLICIES))
+    if policy != AUTO:
+        return policy
+    if compute_time is None:
+        # Not computed by detl, e.g. the outputs of a function with several outputs
+        return PERSIST
+    return PERSIST if compute_time > io_model.save_time(size) + io_model.load_time(size) else MEMORY
@@ -5,9 +5,19 @@ from functools import wraps
 from detl.identity import Identity 
 from detl.wrapper import wrap_results, get_data
 from detl.db_context import db_context
+from detl.serializers import load_auto, save_auto
 
 
-def load_and_save(load_func, save_func, unpack=False):
+def load_and_save(load_func=None, save_func=None, unpack=False, policy=None):
+    '''
+    Identify the results of a function, save them the first time they are computed and load them afterwards.
+    Without load and save functions, the file format is chosen from the type of the results (see detl.serializers).
+    The policy overrides the one of the db to keep the results only in memory or compute them again every time,
+    or to decide from the measured compute and save times (see detl.policy)
+    '''
+    if load_func is None and save_func is None:
+        load_func, save_func = load_auto, save_auto
+
     def fn_wrapper(fn):
         @wraps(fn)
         def identified_fn(*args, **kwargs):
@@ -17,7 +27,8 @@ def load_and_save(load_func, save_func, unpack=False):
                 return fn(*args, **kwargs)
 
             # Wrap results
-            results_wrapped = wrap_results(fn, args, kwargs, unpack_input=unpack, save_fn=save_func, load_fn=load_func)
+            results_wrapped = wrap_results(fn, args, kwargs, unpack_input=unpack, save_fn=save_func, load_fn=load_func,
+                                           policy=policy)
             
             return results_wrapped
         return identified_fn
@@ -51,8 +62,7 @@ class Processor(object):
         class_name = self.__class__.__name__
         self.identity = Identity(class_name, *args, **kwargs)
         if db is not None:
-            fd = db.find(self.identity)
-            if fd is None:
+            if not db.exists(self.identity):
                 db.insert(self, None, save_data=False)
 
     def __id_hash__(self):
@@ -76,8 +86,7 @@ def change_state(fn, load_func=None, save_func=None):
             get_kwargs = {k:get_data(v) for k,v in kwargs.items()}
             return fn(self, *get_args, **get_kwargs)
 
-        fd = db.find(self.identity)
-        if fd is None:
+        if not db.exists(self.identity):
             if save_func is not None and load_func is not None:
                 print('save_func defined')
                 get_args = [get_data(el) for el in args]
@@ -0,0 +1,99 @@
+import os
+import shutil
+import uuid
+import urllib.error
+import urllib.request
+
+# Size of the blocks copied when downloading
+BLOCK_SIZE = 1 << 20
+
+
+class RemoteStore(object):
+    '''
+    The shared tier of the artifact store (see detl.store.ArtifactStore), where the nodes upload the files
+    of the results they compute and download the ones computed by the others. The files are named by keys
+    like 'ab/cd/abcd...npy' and never change once uploaded
+    '''
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def upload(self, key, path):
+        '''Upload a local file, unless a file with the same key was already uploaded'''
+        raise NotImplementedError
+
+    def download(self, key, path):
+        '''Download a file to a local path, raises FileNotFoundError if it is not in the remote store'''
+        raise NotImplementedError
+
+
+class DirectoryRemote(RemoteStore):
+
+    def __init__(self, root):
+        '''A directory shared by the nodes, e.g. a network file system'''
+        self.root = root
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self.root, key))
+
+    def upload(self, key, path):
+        target = os.path.join(self.root, key)
+        if os.path.exists(target):
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Copied next to the target then renamed, the other nodes never see a partial file
+        tmp_path = '%s.%s.tmp' % (target, uuid.uuid4().hex)
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, target)
+
+    def download(self, key, path):
+        shutil.copyfile(os.path.join(self.root, key), path)
+
+
+class HttpRemote(RemoteStore):
+
+    def __init__(self, url, timeout=60):
+        '''
+        An object store accessed with HTTP GET, HEAD and PUT requests on url/key, e.g. a bucket behind a
+        presigning proxy or a local stand-in server
+        '''
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _request(self, key, method, data=None):
+        request = urllib.request.Request('%s/%s' % (self.url, key), data=data, method=method)
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def exists(self, key):
+        try:
+            with self._request(key, 'HEAD'):
+                return True
+        except urllib.error.HTTPError as error:
+            if error.code == 404:
+                return False
+            raise
+
+    def upload(self, key, path):
+        if self.exists(key):
+            return
+        with open(path, 'rb') as fd:
+            request = urllib.request.Request('%s/%s' % (self.url, key), data=fd, method='PUT',
+                                             headers={'Content-Length': str(os.path.getsize(path))})
+            urllib.request.urlopen(request, timeout=self.timeout).close()
+
+    def download(self, key, path):
+        try:
+            response = self._request(key, 'GET')
+        except urllib.error.HTTPError as error:
+            if error.code == 404:
+                raise FileNotFoundError(key)
+            raise
+        with response, open(path, 'wb') as fd:
+            shutil.copyfileobj(response, fd, BLOCK_SIZE)
+
+
+def remote_from_config(remote):
+    '''The remote store of a url or of a shared directory'''
+    if remote.startswith('http://') or remote.startswith('https://'):
+        return HttpRemote(remote)
+    return DirectoryRemote(remote)
@@ -0,0 +1,198 @@
+import os
+import pickle
+import numpy as np
+
+
+class Serializer(object):
+
+    def __init__(self, name, extension, save, load):
+        '''
+        A file format for the results. save(obj, file_path) writes obj to file_path, which ends with the
+        extension, and load(file_path) reads it back
+        '''
+        self.name = name
+        self.extension = extension
+        self.save = save
+        self.load = load
+
+
+# The serializers by name, and the names of the serializers of each type (module and qualified name)
+SERIALIZERS = {}
+TYPE_SERIALIZERS = {}
+
+
+def register_serializer(serializer, *type_names):
+    '''
+    Register a serializer, used for the results whose type (or one of its base classes) is in type_names, e.g.
+    'numpy.ndarray'. The types are given by name so that their module does not have to be imported
+    '''
+    SERIALIZERS[serializer.name] = serializer
+    for type_name in type_names:
+        TYPE_SERIALIZERS[type_name] = serializer.name
+
+
+def serializer_for(obj):
+    '''The serializer of the most specific registered type of obj, pickle by default'''
+    for cls in type(obj).__mro__:
+        name = TYPE_SERIALIZERS.get(cls.__module__ + '.' + cls.__qualname__)
+        if name is not None:
+            serializer = SERIALIZERS[name]
+            if name != 'npy' or obj.dtype != object:
+                return serializer
+    return SERIALIZERS['pickle']
+
+
+def save_auto(obj, file_path):
+    '''
+    The default save function of load_and_save : the format is chosen from the type of the result. Returns
+    the format and the actual file descriptor, recorded in the metadata
+    '''
+    return _save(serializer_for(obj), obj, file_path)
+
+
+def save_outputs(results, file_path):
+    '''The default save function of the functions with several outputs, all saved in one file (see save_packed)'''
+    return _save(SERIALIZERS['packed'], results, file_path)
+
+
+def _save(serializer, obj, file_path):
+    file_path = file_path + serializer.extension
+    serializer.save(obj, file_path)
+    return {'format': serializer.name, 'file_descriptor': file_path}
+
+
+def load_auto(fd):
+    '''The default load function of load_and_save, the format is given by the extension of the file'''
+    for serializer in SERIALIZERS.values():
+        if fd.endswith(serializer.extension):
+            return serializer.load(fd)
+    raise ValueError('No serializer for %s' % fd)
+
+
+def save_pickle(obj, file_path):
+    with open(file_path, 'wb') as fd:
+        pickle.dump(obj, fd, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_pickle(file_path):
+    with open(file_path, 'rb') as fd:
+        return pickle.load(fd)
+
+
+def save_npy(arr, file_path):
+    np.save(file_path, arr, allow_pickle=False)
+
+
+def load_npy(file_path):
+    '''Memory mapped and read only : nothing is read before the data is used'''
+    return np.load(file_path, mmap_mode='r')
+
+
+def save_columns(df, file_path):
+    '''
+    A DataFrame as a folder with one npy file per column, the columns of object dtype are pickled.
+    The column labels and the index are pickled with the list of files
+    '''
+    os.mkdir(file_path)
+    files = []
+    for i, (_, column) in enumerate(df.items()):
+        values = column.to_numpy()
+        if values.dtype == object or values.dtype != column.dtype:
+            fname = '%d.pkl' % i
+            save_pickle(column.array, os.path.join(file_path, fname))
+        else:
+            fname = '%d.npy' % i
+            save_npy(values, os.path.join(file_path, fname))
+        files.append(fname)
+    save_pickle({'columns': df.columns, 'index': df.index, 'files': files}, os.path.join(file_path, 'meta.pkl'))
+
+
+def load_columns(file_path):
+    import pandas as pd
+
+    meta = load_pickle(os.path.join(file_path, 'meta.pkl'))
+    columns = {}
+    for i, fname in enumerate(meta['files']):
+        path = os.path.join(file_path, fname)
+        columns[i] = load_npy(path) if fname.endswith('.npy') else load_pickle(path)
+    # copy=False keeps the memory mapped columns
+    df = pd.DataFrame(columns, index=meta['index'], copy=False)
+    df.columns = meta['columns']
+    return df
+
+
+# Packed files : the magic, the length of the offset table, the pickled offset table, then the outputs,
+# each aligned so that the arrays can be memory mapped
+PACKED_MAGIC = b'DETLPACK'
+PACKED_ALIGNMENT = 64
+
+
+def _align(offset):
+    return -(-offset // PACKED_ALIGNMENT) * PACKED_ALIGNMENT
+
+
+def save_packed(results, file_path):
+    '''
+    The outputs of a function with several outputs in a single file with an offset table. The arrays are
+    written as raw buffers, the other outputs are pickled
+    '''
+    buffers = []
+    table = []
+    offset = 0
+    for res in results:
+        if isinstance(res, np.ndarray) and res.dtype != object:
+            res = np.asarray(res)
+            order = 'F' if res.flags.f_contiguous and not res.flags.c_contiguous else 'C'
+            buf = res.tobytes(order=order)
+            table.append({'offset': offset, 'length': len(buf), 'dtype': res.dtype.str, 'shape': res.shape,
+                          'order': order})
+        else:
+            buf = pickle.dumps(res, protocol=pickle.HIGHEST_PROTOCOL)
+            table.append({'offset': offset, 'length': len(buf)})
+        buffers.append(buf)
+        offset = _align(offset + len(buf))
+
+    header = pickle.dumps(table, protocol=pickle.HIGHEST_PROTOCOL)
+    start = _align(len(PACKED_MAGIC) + 8 + len(header))
+    with open(file_path, 'wb') as fd:
+        fd.write(PACKED_MAGIC + len(header).to_bytes(8, 'little') + header)
+        for entry, buf in zip(table, buffers):
+            fd.seek(start + entry['offset'])
+            fd.write(buf)
+
+
+def _read_table(fd):
+    if fd.read(len(PACKED_MAGIC)) != PACKED_MAGIC:
+        raise ValueError('%s is not a packed file' % fd.name)
+    length = int.from_bytes(fd.read(8), 'little')
+    table = pickle.loads(fd.read(length))
+    return table, _align(len(PACKED_MAGIC) + 8 + length)
+
+
+def load_packed(file_path, index=None):
+    '''
+    All the outputs of a packed file, or only the one at index. Only the offset table and the requested
+    output are read, the arrays are memory mapped (read only)
+    '''
+    with open(file_path, 'rb') as fd:
+        table, start = _read_table(fd)
+        entries = table if index is None else [table[index]]
+        results = []
+        for entry in entries:
+            if 'dtype' in entry and entry['length'] == 0:
+                # An empty buffer cannot be memory mapped
+                results.append(np.empty(entry['shape'], dtype=np.dtype(entry['dtype'])))
+            elif 'dtype' in entry:
+                results.append(np.memmap(file_path, dtype=np.dtype(entry['dtype']), mode='r',
+                                         offset=start + entry['offset'], shape=entry['shape'], order=entry['order']))
+            else:
+                fd.seek(start + entry['offset'])
+                results.append(pickle.loads(fd.read(entry['length'])))
+    return results if index is None else results[0]
+
+
+register_serializer(Serializer('pickle', '.pkl', save_pickle, load_pickle))
+register_serializer(Serializer('npy', '.npy', save_npy, load_npy), 'numpy.ndarray')
+register_serializer(Serializer('columns', '.npcols', save_columns, load_columns), 'pandas.DataFrame',
+                    'pandas.core.frame.DataFrame')
+register_serializer(Serializer('packed', '.pack', save_packed, load_packed))
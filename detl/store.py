@@ -0,0 +1,341 @@
+import glob
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from detl.remote import remote_from_config
+
+try:
+    import fcntl
+except ImportError:
+    # No file locks on windows, the reference files are then not safe for concurrent processes
+    fcntl = None
+
+# Size of the chunks read to compute the digests
+CHUNK_SIZE = 1 << 20
+
+# Number of files of a result uploaded or downloaded at once
+TRANSFER_WORKERS = 8
+
+
+class ArtifactStore(object):
+
+    def __init__(self, root, remote=None, max_local_size=None):
+        '''
+        The saved results, named by a digest of their content under root/objects/ab/cd/, so that identical
+        results of different configurations are stored once. The results are first saved to a temporary path,
+        then moved to their final path (see put). Each stored result has a reference file listing the config
+        hashes of the results using it, the result is deleted when the last one is released.
+
+        With a remote store (see detl.remote), the results are also uploaded to it, and the results computed
+        by other nodes are downloaded on demand (see fetch). The local folder is then a cache of at most
+        max_local_size bytes, the results used least recently are deleted from it
+        '''
+        self.root = root
+        self.tmp_folder = os.path.join(root, 'tmp')
+        self.objects_folder = os.path.join(root, 'objects')
+        self.remote = remote
+        self.max_local_size = max_local_size
+        # The folders already created by this process
+        self._folders = set()
+        # Size of the local results, computed on first use
+        self._local_size = None
+        self._lock = threading.Lock()
+        self._fetch_locks = defaultdict(threading.Lock)
+
+    def __reduce__(self):
+        return ArtifactStore, (self.root, self.remote, self.max_local_size)
+
+    def _makedirs(self, folder):
+        if folder not in self._folders:
+            os.makedirs(folder, exist_ok=True)
+            self._folders.add(folder)
+
+    def temp_path(self):
+        '''A new temporary path, where a result is saved before being put to the store'''
+        self._makedirs(self.tmp_folder)
+        return os.path.join(self.tmp_folder, uuid.uuid4().hex)
+
+    def put(self, base_path, fd, config_hash):
+        '''
+        Move a result saved to the temporary base_path to the store, and return its file descriptor and the
+        description of the artifact, recorded in the metadata (see fetch). The save function may have written
+        base_path and files or folders named base_path + extension, fd is the file descriptor it recorded. If
+        the same content is already stored, the new files are deleted. The artifact also gives the size in bytes
+        '''
+        digest = content_digest(base_path)
+        final_path = self._blob(digest)
+        self._makedirs(os.path.dirname(final_path))
+        suffixes = [path[len(base_path):] for path in written_paths(base_path)]
+        added = 0
+        # Locked so that the result cannot be deleted by a concurrent release before it is referenced
+        with _locked(final_path + '.refs') as refs:
+            for suffix in suffixes:
+                if os.path.exists(final_path + suffix):
+                    _remove(base_path + suffix)
+                else:
+                    added += _size(base_path + suffix)
+                    # Atomic : readers see either nothing or the whole result
+                    os.replace(base_path + suffix, final_path + suffix)
+            _add_ref(refs, config_hash)
+
+        files = _files(final_path)
+        if self.remote is not None:
+            _concurrently(lambda name: self.remote.upload(_key(digest, name), final_path + name), files)
+        self._add_local_size(added, final_path)
+        size = sum(_size(final_path + name) for name in files)
+        return final_path + fd[len(base_path):], {'digest': digest, 'files': files, 'size': size}
+
+    def fetch(self, artifact, fd):
+        '''
+        The local file descriptor of a result (fd is its file descriptor on the node that saved it). If the
+        result is not in the local folder, its files are downloaded concurrently from the remote store and
+        their digest is checked before they are moved to the local folder
+        '''
+        digest = artifact['digest']
+        final_path = self._blob(digest)
+        local_fd = final_path + os.path.basename(fd)[len(digest):]
+        with self._fetch_locks[digest]:
+            if all(os.path.exists(final_path + name) for name in artifact['files']):
+                # The modification time orders the local results for the eviction
+                _touch(final_path)
+                return local_fd
+            if self.remote is None:
+                raise FileNotFoundError('%s is not stored locally and there is no remote store' % fd)
+
+            base_path = self.temp_path()
+            for name in artifact['files']:
+                os.makedirs(os.path.dirname(base_path + name), exist_ok=True)
+            _concurrently(lambda name: self.remote.download(_key(digest, name), base_path + name),
+                          artifact['files'])
+            if content_digest(base_path) != digest:
+                for path in written_paths(base_path):
+                    _remove(path)
+                raise IOError('The checksum of the downloaded result %s does not match' % digest)
+
+            self._makedirs(os.path.dirname(final_path))
+            added = 0
+            with _locked(final_path + '.refs'):
+                for path in written_paths(base_path):
+                    suffix = path[len(base_path):]
+                    if os.path.exists(final_path + suffix):
+                        _remove(path)
+                    else:
+                        added += _size(path)
+                        os.replace(path, final_path + suffix)
+            _touch(final_path)
+        self._add_local_size(added, final_path)
+        return local_fd
+
+    def _add_local_size(self, added, keep):
+        if self.max_local_size is None or self.remote is None:
+            return
+        with self._lock:
+            if self._local_size is None:
+                self._local_size = sum(size for _, size, _ in self._local_blobs())
+            else:
+                self._local_size += added
+            if self._local_size > self.max_local_size:
+                self._evict(keep)
+
+    def _local_blobs(self):
+        '''The local results as (path without extension, size, last use)'''
+        blobs = []
+        for folder, _, names in os.walk(self.objects_folder):
+            for name in names:
+                if name.endswith('.refs'):
+                    blob = os.path.join(folder, name[:-len('.refs')])
+                    paths = [path for path in written_paths(blob) if not path.endswith('.refs')]
+                    if paths:
+                        blobs.append((blob, sum(_size(path) for path in paths), os.path.getmtime(blob + '.refs')))
+        return blobs
+
+    def _evict(self, keep):
+        '''
+        Delete the local results used least recently, except keep, the result just used. They can be downloaded
+        again from the remote store
+        '''
+        blobs = sorted(self._local_blobs(), key=lambda blob: blob[2])
+        self._local_size = sum(size for _, size, _ in blobs)
+        for blob, size, _ in blobs:
+            if self._local_size <= self.max_local_size:
+                break
+            if blob == keep:
+                continue
+            with _locked(blob + '.refs'):
+                for path in written_paths(blob):
+                    if not path.endswith('.refs'):
+                        _remove(path)
+            self._local_size -= size
+
+    def delete(self, blob, unless_used_since=None):
+        '''
+        Delete the files of a stored result (blob is its path without extension), whatever its references. Returns
+        the number of bytes freed, nothing is deleted if the result was stored or used after unless_used_since
+        '''
+        freed = 0
+        with _locked(blob + '.refs'):
+            if unless_used_since is not None and os.path.getmtime(blob + '.refs') > unless_used_since:
+                return 0
+            for path in written_paths(blob):
+                if not path.endswith('.refs'):
+                    freed += _size(path)
+                    _remove(path)
+        with self._lock:
+            if self._local_size is not None:
+                self._local_size -= freed
+        return freed
+
+    def _blob(self, fd):
+        '''The path of the stored result of a file descriptor (or digest), without the extension'''
+        name = os.path.basename(fd).split('.')[0]
+        return os.path.join(self.objects_folder, name[:2], name[2:4], name)
+
+    def owns(self, fd):
+        return os.path.abspath(fd).startswith(os.path.abspath(self.objects_folder) + os.sep)
+
+    def add_ref(self, fd, config_hash):
+        with _locked(self._blob(fd) + '.refs') as refs:
+            _add_ref(refs, config_hash)
+
+    def refs(self, fd):
+        '''The config hashes of the results using a stored result'''
+        path = self._blob(fd) + '.refs'
+        if not os.path.exists(path):
+            return set()
+        with open(path) as refs:
+            return _read_refs(refs)
+
+    def release(self, fd, config_hash):
+        '''
+        Remove a reference to a stored result, and delete the result if it was the last one. Returns whether
+        it was deleted
+        '''
+        blob = self._blob(fd)
+        with _locked(blob + '.refs') as refs:
+            remaining = _read_refs(refs) - {config_hash}
+            refs.seek(0)
+            refs.truncate()
+            refs.writelines(ref + '\n' for ref in sorted(remaining))
+            if remaining:
+                return False
+            # The empty reference file is kept, a concurrent put may be waiting for its lock
+            for path in written_paths(blob):
+                if not path.endswith('.refs'):
+                    _remove(path)
+        return True
+
+
+def store_from_config(config):
+    '''The artifact store of the data folder of a config, with its remote store if any'''
+    remote = config.get('remote')
+    return ArtifactStore(config['data_folder'], remote=remote_from_config(remote) if remote else None,
+                         max_local_size=config.get('max_local_size'))
+
+
+def content_digest(base_path):
+    '''The digest of the names and contents of the files and folders named base_path or base_path + extension'''
+    suffixes = [path[len(base_path):] for path in written_paths(base_path)]
+    if not suffixes:
+        raise ValueError('Nothing was saved to %s' % base_path)
+
+    digest = hashlib.blake2b(digest_size=16)
+    for suffix in sorted(suffixes):
+        digest.update(suffix.encode() + b'\0')
+        _update_digest(digest, base_path + suffix)
+    return digest.hexdigest()
+
+
+def written_paths(base_path):
+    '''The files and folders named base_path or base_path + extension'''
+    paths = glob.glob(glob.escape(base_path) + '.*')
+    if os.path.exists(base_path):
+        paths.append(base_path)
+    return paths
+
+
+def _update_digest(digest, path):
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            digest.update(name.encode() + b'\0')
+            _update_digest(digest, os.path.join(path, name))
+        return
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+
+def _files(blob):
+    '''The files of a stored result, relative to its path without extension'''
+    files = []
+    for path in written_paths(blob):
+        if path.endswith('.refs'):
+            continue
+        if os.path.isdir(path):
+            for folder, _, names in os.walk(path):
+                files += [os.path.join(folder, name)[len(blob):] for name in names]
+        else:
+            files.append(path[len(blob):])
+    return sorted(files)
+
+
+def _concurrently(fn, names):
+    if len(names) == 1:
+        fn(names[0])
+        return
+    with ThreadPoolExecutor(TRANSFER_WORKERS) as pool:
+        list(pool.map(fn, names))
+
+
+def _key(digest, name):
+    '''The key of a file of a result in the remote store'''
+    return '/'.join([digest[:2], digest[2:4], digest + name.replace(os.sep, '/')])
+
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(folder, name)) for folder, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path)
+
+
+def _touch(blob):
+    refs = blob + '.refs'
+    if os.path.exists(refs):
+        os.utime(refs)
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def _add_ref(refs, config_hash):
+    if config_hash not in _read_refs(refs):
+        refs.write(config_hash + '\n')
+
+
+def _read_refs(refs):
+    refs.seek(0)
+    return {line.strip() for line in refs if line.strip()}
+
+
+class _locked(object):
+    '''A reference file opened for update and locked'''
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.fd = open(self.path, 'a+')
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self.fd
+
+    def __exit__(self, *exc):
+        # Closing the file releases the lock
+        self.fd.close()
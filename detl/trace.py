@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# The functions called with each span that ends. The spans are only measured while there is a hook, the code
+# of detl checks this list before creating them
+hooks = []
+
+# The phases of the work on a node :
+#   'hash' : computing the hash of an identity
+#   'find' : looking up metadata
+#   'data' : getting the data of a wrapper, including the data of its dependencies
+#   'memory' : a result found in the result cache
+#   'load' : loading a saved result with its load function
+#   'compute' : running the function of a wrapper
+#   'save' : saving a result with its save function and moving it to the store
+#   'insert' : saving and inserting a result with its metadata
+# The phases counted as the own time of a node, 'insert' includes 'save'
+NODE_PHASES = ('hash', 'find', 'load', 'compute', 'insert')
+
+
+class Span(object):
+
+    def __init__(self, phase, name=None, hash_value=None, **fields):
+        '''
+        A timed phase of the work on a node, with the name and hash of its identity if any. The fields give
+        details, e.g. bytes for the size of the loaded and saved results or found for the metadata lookups
+        '''
+        self.phase = phase
+        self.name = name
+        self.hash = hash_value
+        self.fields = fields
+        self.pid = os.getpid()
+        self.thread = threading.get_ident()
+        self.start = time.perf_counter()
+        self.end = None
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return 'Span(%s, %s, %s, %.6fs, %s)' % (self.phase, self.name, self.hash, self.duration, self.fields)
+
+
+def add_hook(hook):
+    hooks.append(hook)
+
+
+def remove_hook(hook):
+    hooks.remove(hook)
+
+
+def emit(span):
+    for hook in list(hooks):
+        try:
+            hook(span)
+        except Exception:
+            logging.exception('The trace hook %s failed', hook)
+
+
+@contextmanager
+def span(phase, identity=None, **fields):
+    '''Measure a phase of the work on the node of identity, see Span. The fields can be added while it runs'''
+    current = Span(phase, None if identity is None else identity.name,
+                   None if identity is None else identity._id_hash, **fields)
+    try:
+        yield current
+    finally:
+        current.end = time.perf_counter()
+        if current.hash is None and identity is not None:
+            current.hash = identity._id_hash
+        emit(current)
+
+
+def record(phase, identity, start, end, **fields):
+    '''A span measured elsewhere, e.g. the computations run by worker processes'''
+    current = Span(phase, identity.name, identity.__id_hash__(), **fields)
+    current.start = start
+    current.end = end
+    emit(current)
+
+
+class Profile(object):
+
+    def __init__(self):
+        '''A hook collecting the spans, with a summary of where the time is spent (see report)'''
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def phases(self):
+        '''The number of spans and the total time by phase'''
+        phases = defaultdict(lambda: [0, 0.])
+        for span in self.spans:
+            phases[span.phase][0] += 1
+            phases[span.phase][1] += span.duration
+        return {phase: tuple(total) for phase, total in phases.items()}
+
+    def hit_rate(self):
+        '''The share of the results that were taken from memory or loaded rather than computed'''
+        counts = defaultdict(int)
+        for span in self.spans:
+            counts[span.phase] += 1
+        hits = counts['memory'] + counts['load']
+        total = hits + counts['compute']
+        return hits / total if total else None
+
+    def node_times(self):
+        '''The own time of each node (see NODE_PHASES), by hash'''
+        times = defaultdict(float)
+        for span in self.spans:
+            if span.hash is not None and span.phase in NODE_PHASES:
+                times[span.hash] += span.duration
+        return times
+
+    def names(self):
+        return {span.hash: span.name for span in self.spans if span.hash is not None}
+
+    def slowest(self, count=10):
+        '''The nodes with the longest own time, as (name, hash, seconds)'''
+        names = self.names()
+        times = sorted(self.node_times().items(), key=lambda item: item[1], reverse=True)
+        return [(names[hash_value], hash_value, seconds) for hash_value, seconds in times[:count]]
+
+    def critical_path(self):
+        '''
+        The longest chain of computed nodes, each depending on the previous one, as (seconds, hashes). Its time
+        is the least time the graph can take with unlimited workers
+        '''
+        times = self.node_times()
+        dependencies = {span.hash: span.fields.get('deps', ()) for span in self.spans if span.phase == 'compute'}
+        longest = {}
+        for root in times:
+            stack = [root]
+            while stack:
+                node = stack[-1]
+                if node in longest:
+                    stack.pop()
+                    continue
+                missing = [dep for dep in dependencies.get(node, ()) if dep in times and dep not in longest]
+                if missing:
+                    stack.extend(missing)
+                    continue
+                stack.pop()
+                deps = [dep for dep in dependencies.get(node, ()) if dep in longest]
+                previous = max(deps, key=lambda dep: longest[dep][0], default=None)
+                seconds, path = longest[previous] if previous is not None else (0., [])
+                longest[node] = (seconds + times[node], path + [node])
+        return max(longest.values(), key=lambda item: item[0], default=(0., []))
+
+    def report(self, count=5):
+        lines = ['%-8s %8d spans %10.3fs' % (phase, number, seconds)
+                 for phase, (number, seconds) in sorted(self.phases().items(), key=lambda item: -item[1][1])]
+        hit_rate = self.hit_rate()
+        if hit_rate is not None:
+            lines.append('Hit rate : %.1f%%' % (100 * hit_rate))
+        lines.append('Slowest nodes :')
+        lines += ['  %-30s %s %10.3fs' % (name, hash_value[:12], seconds)
+                  for name, hash_value, seconds in self.slowest(count)]
+        seconds, path = self.critical_path()
+        names = self.names()
+        lines.append('Critical path : %.3fs, %s' % (seconds, ' -> '.join(names[node] for node in path)))
+        return '\n'.join(lines)
+
+    def export(self, path):
+        '''Write the spans to a Chrome trace file, to open in chrome://tracing or Perfetto'''
+        export_chrome_trace(self.spans, path)
+
+
+def export_chrome_trace(spans, path):
+    '''Write spans to a file in the Chrome trace event format, a JSON list of complete events'''
+    origin = min((span.start for span in spans), default=0.)
+    events = []
+    for span in spans:
+        args = dict(span.fields)
+        if span.hash is not None:
+            args['hash'] = span.hash
+        events.append({'name': span.phase if span.name is None else '%s %s' % (span.phase, span.name),
+                       'cat': span.phase, 'ph': 'X', 'pid': span.pid, 'tid': span.thread,
+                       'ts': (span.start - origin) * 1e6, 'dur': span.duration * 1e6, 'args': args})
+    with open(path, 'w') as fd:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fd, default=str)
+
+
+@contextmanager
+def profile(path=None):
+    '''
+    Collect the spans of the computations run in the context, from all the threads of the process, in a
+    Profile. The trace is written to path when the context exits, if given
+    '''
+    current = Profile()
+    add_hook(current)
+    try:
+        yield current
+    finally:
+        remove_hook(current)
+        if path is not None:
+            current.export(path)
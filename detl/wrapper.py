@@ -1,17 +1,49 @@
 from detl.identity import Identity
 from detl.db_context import db_context
+from detl.cache import result_cache, sizeof
+from detl.serializers import SERIALIZERS, load_packed
+from detl.policy import decide, PERSIST, RECOMPUTE
+from detl import trace
 import importlib
+import inspect
+import time
 
-def load(load_fn, fd, unpack=False):
+# Marks a result that is not in the result cache
+_NOT_CACHED = object()
 
-    if unpack:
-        return [load_fn(sfd) for sfd in fd]
+def load(load_fn, fd, index=None):
+    '''
+    Load a saved result. The outputs of a function with several outputs may be saved in a single packed
+    file, index is then the position of the output to load, None for all of them
+    '''
+    if fd.endswith(SERIALIZERS['packed'].extension):
+        return load_packed(fd, index)
 
     return load_fn(fd)
 
+def _fn_reference(fn):
+    '''
+    A picklable reference to a function. The decorated functions cannot be pickled directly because
+    their name refers to the decorator in their module
+    '''
+    if '<locals>' in fn.__qualname__:
+        return fn
+    return fn.__module__, fn.__qualname__
+
+
+def _resolve_fn(fn_ref):
+    '''The undecorated function of a reference, see _fn_reference'''
+    if callable(fn_ref):
+        return fn_ref
+    module_name, qualname = fn_ref
+    fn = importlib.import_module(module_name)
+    for attr in qualname.split('.'):
+        fn = getattr(fn, attr)
+    return inspect.unwrap(fn)
+
 class Wrapper(object):
 
-    def __init__(self, fn, args, kwargs, unpack_input=False, save_fn=None, load_fn=None):
+    def __init__(self, fn, args, kwargs, unpack_input=False, save_fn=None, load_fn=None, policy=None):
 
         self.fn = fn
         self.args = args
@@ -19,7 +51,10 @@ class Wrapper(object):
 
         self.identity = Identity(fn.__name__, *args, **kwargs, unpack=unpack_input, save_fn=save_fn, load_fn=load_fn)
 
+        # The number of outputs of the function if they are unpacked
         self.unpack = unpack_input
+        # The position of the output for the unpacked outputs, see get_unpacked_child
+        self.index = None
         # if self.unpack:
         #    db = db_context.get_db()
         #    if db:
@@ -28,6 +63,10 @@ class Wrapper(object):
         
         self.save_fn = save_fn
         self.load_fn = load_fn
+        # How the result is kept, the policy of the db by default (see detl.policy)
+        self.policy = policy
+        # Time taken by the function the last time it was computed, in seconds
+        self.compute_time = None
         
         self._data = None
 
@@ -43,58 +82,157 @@ class Wrapper(object):
         if 'file_descriptor' not in conf_dict:
             raise ValueError('No filename')
 
-        fd = conf_dict['file_descriptor']
-        
         wrap.identity = Identity.from_dict(conf_dict)
         wrap.load_module = importlib.import_module(conf_dict['load_fn']['fn_module'])
         load_fn = getattr(wrap.load_module, conf_dict['load_fn']['fn_name'])
 
-        wrap._data = load_fn(fd)
+        # The outputs of a function with several outputs are taken from their packed file
+        wrap._data = load(load_fn, db.local_file(conf_dict), index=conf_dict.get('index'))
 
         return wrap
 
+    def __getstate__(self):
+        '''
+        The wrappers are pickled with a reference to their function, e.g. the wrappers in the identity of a
+        Processor sent to the worker processes of the executor
+        '''
+        state = dict(self.__dict__)
+        state['fn'] = _fn_reference(self.fn)
+        return state
+
+    def __setstate__(self, state):
+        state['fn'] = _resolve_fn(state['fn'])
+        self.__dict__.update(state)
+
     def __id_hash__(self):
 
         return self.identity.__id_hash__()
 
     @property
     def data(self, save_data=True):
-
+        '''
+        The result, taken from the result cache, loaded from disk or computed. The results are shared
+        between the wrappers with the same identity, so they should not be modified in place
+        '''
         if self._data is not None:
             return self._data
+        if not trace.hooks:
+            return self._get(save_data)
+        with trace.span('data', self.identity):
+            return self._get(save_data)
 
+    def _get(self, save_data=True):
         db = db_context.get_db()
 
         if db is None:
-            get_args = [get_data(arg) for arg in self.args]
-            get_kwargs = {k:get_data(v) for k,v in self.kwargs.items()}
-            results = self.fn(*get_args, **get_kwargs)
+            results = self._compute()
             self._data = results
- 
-        fd = db.find_file(self.identity, unpack_input=self.unpack, unpack_len=4)
+            return results
 
-        # Either fd is not none for the base case or none of the unpacked fd is None
-        # TODO : not clean or understandable
-        if (fd is not None and not self.unpack) or \
-                (self.unpack and not any(el is None for el in fd)):
-            return load(self.load_fn, fd, unpack=self.unpack)
+        if db.lazy or db.executor is not None:
+            # Imported here, the planner module depends on this one
+            from detl.planner import materialize
+            return materialize([self])[0]
 
-            # If not, compute and insert
-        else:
-            get_args = [get_data(arg) for arg in self.args]
-            get_kwargs = {k:get_data(v) for k,v in self.kwargs.items()}
-            results = self.fn(*get_args, **get_kwargs)
+        return self._get_data(db, save_data=save_data)
+
+    def _get_data(self, db, save_data=True):
+        '''Load or compute (and insert) the result, assuming the data of the dependencies is available'''
+        results = self._load(db)
+        if results is _NOT_CACHED:
+            results = self._compute()
+            self._store(db, results, save_data=save_data)
+        return results
+
+    def _load(self, db):
+        '''The result from the result cache or from disk, _NOT_CACHED if it has to be computed'''
+        hash_value = self.__id_hash__()
+        results = result_cache.get(self._cache_key(db), _NOT_CACHED)
+        if results is not _NOT_CACHED:
+            if trace.hooks:
+                now = time.perf_counter()
+                trace.record('memory', self.identity, now, now)
             self._data = results
-            db._insert(self.identity, results, self.save_fn, save_data=save_data)
+            return results
+
+        # The result may be being written in the background
+        db.wait_written([hash_value])
+        fd = db.find_file(self.identity)
+        if fd is not None:
+            start = time.perf_counter()
+            results = load(self.load_fn, fd, index=self.index)
+            end = time.perf_counter()
+            size = db.record_load(self.identity, end - start)
+            if trace.hooks:
+                trace.record('load', self.identity, start, end, bytes=size)
+            self._data = results
+            result_cache.put(self._cache_key(db), results)
+            return results
+
+        return _NOT_CACHED
+
+    def _compute(self):
+        get_args = [get_data(arg) for arg in self.args]
+        get_kwargs = {k:get_data(v) for k,v in self.kwargs.items()}
+        start = time.perf_counter()
+        results = self.fn(*get_args, **get_kwargs)
+        end = time.perf_counter()
+        self.compute_time = end - start
+        if trace.hooks:
+            trace.record('compute', self.identity, start, end, deps=[dep.__id_hash__() for dep in self.dependencies()])
         return results
 
+    def _store(self, db, results, save_data=True):
+        '''
+        Insert a computed result to the db with the time it took, and keep it in memory. Depending on the policy
+        (see detl.policy), the result is saved, or only inserted to be computed again when it is needed
+        '''
+        stats, policy = None, None
+        if self.index is None:
+            stats = {'compute_time': self.compute_time, 'output_size': sizeof(results)}
+            policy = decide(self.policy or db.policy, self.compute_time, stats['output_size'])
+            save_data = save_data and policy == PERSIST
+        if self.unpack:
+            # The outputs are inserted with the result, see MyDb._insert_unpacked
+            children = [self.get_unpacked_child(i) for i in range(self.unpack)]
+            db.write(self, db._insert_unpacked, self.identity, results, self.save_fn,
+                     [child.identity for child in children], save_data=save_data, stats=stats)
+            if policy != RECOMPUTE:
+                for child, res in zip(children, results):
+                    result_cache.put(child._cache_key(db), res)
+        elif self.index is not None:
+            # An output is inserted when the result it is taken from is, unless the result was not computed
+            parent = self.args[0]
+            if not db.is_pending(parent.__id_hash__()) and not db.exists(self.identity):
+                parent._store(db, parent._data, save_data=save_data)
+        else:
+            db.write(self, db._insert, self.identity, results, self.save_fn, save_data=save_data, stats=stats)
+        self._data = results
+        if policy != RECOMPUTE:
+            result_cache.put(self._cache_key(db), results)
+
+    def _cache_key(self, db):
+        '''The key of the result in the result cache, the results are kept separately for each db'''
+        return db.token, self.__id_hash__()
+
+    def explain(self):
+        '''The execution plan of the data, see detl.planner.Plan'''
+        from detl.planner import Plan
+        return Plan([self]).explain()
+
+    def dependencies(self):
+        '''The wrappers whose data is needed to compute this one'''
+        return [arg for arg in list(self.args) + list(self.kwargs.values()) if isinstance(arg, Wrapper)]
+
     def get_unpacked_child(self, ind):
 
         if not self.unpack:
             raise ValueError
 
-        return Wrapper(index_unpackable, [self, ind], {}, unpack_input=False, 
-                    save_fn=self.save_fn, load_fn=self.load_fn)
+        child = Wrapper(index_unpackable, [self, ind], {}, unpack_input=False,
+                        save_fn=self.save_fn, load_fn=self.load_fn, policy=self.policy)
+        child.index = ind
+        return child
 
 
 class SourceWrapper(Wrapper):
@@ -104,22 +242,31 @@ class SourceWrapper(Wrapper):
         self.identity = SourceIdentity(identifier)
         self.obj = obj
         db = db_context.get_db()
-        fd = db.find(self.identity)
-        if fd is None:
+        if not db.exists(self.identity):
             db._insert(self.identity, None, save_data=False)
         
     def data(self):
         return obj
 
 
+def returner(obj, identifier=None):
+    '''The function of the wrapped objects, see wrap_obj'''
+    return obj
+
+
 def wrap_obj(obj, identifier, unpack_input=False, save_fn=None, load_fn=None):
-    
-    return Wrapper(returner, [obj], {}, unpack_input=unpack_input, save_fn=save_fn, load_fn=load_fn)
+    '''
+    An identified source object, identified by identifier and by its content. Arrays and pandas objects are
+    identified by their memory buffers (see detl.fingerprint)
+    '''
+    return Wrapper(returner, [obj], {'identifier': identifier}, unpack_input=unpack_input, save_fn=save_fn,
+                   load_fn=load_fn)
 
 
-def wrap_results(fn, args, kwargs, unpack_input=False, save_fn=None, load_fn=None):
+def wrap_results(fn, args, kwargs, unpack_input=False, save_fn=None, load_fn=None, policy=None):
     
-    all_res_wrapped = Wrapper(fn, args, kwargs, unpack_input=unpack_input, save_fn=save_fn, load_fn=load_fn)
+    all_res_wrapped = Wrapper(fn, args, kwargs, unpack_input=unpack_input, save_fn=save_fn, load_fn=load_fn,
+                              policy=policy)
 
     if unpack_input:
         return unpack_results(all_res_wrapped, unpack_input)
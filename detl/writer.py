@@ -0,0 +1,113 @@
+import atexit
+import logging
+import queue
+import threading
+import weakref
+from concurrent.futures import Future
+from contextvars import copy_context
+
+# Number of threads saving and inserting the results
+DEFAULT_WRITERS = 4
+# Number of results waiting to be written before the computations are blocked
+DEFAULT_MAX_PENDING = 64
+
+# The writers that are not closed, flushed when the process exits
+_writers = weakref.WeakSet()
+
+
+class Writer(object):
+
+    def __init__(self, workers=DEFAULT_WRITERS, max_pending=DEFAULT_MAX_PENDING):
+        '''
+        Write behind : the results are saved and inserted by a pool of threads while the computations go on.
+        At most max_pending writes are queued, submit blocks when the queue is full. A write starts after the
+        writes of the results it depends on, so the metadata of the parents is inserted first, and the
+        metadata of a result is inserted once its file is fully written
+        '''
+        self.queue = queue.Queue(max_pending)
+        # The futures of the writes not done yet, by identity hash
+        self.pending = {}
+        self.errors = []
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, name='detl-writer-%d' % i, daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+        self.closed = False
+        _writers.add(self)
+
+    def submit(self, key, dependencies, fn, *args, **kwargs):
+        '''Run fn(*args, **kwargs) in the background, after the writes of the dependencies (identity hashes)'''
+        if self.closed:
+            raise ValueError('The writer is closed')
+        future = Future()
+        with self.lock:
+            waits = [self.pending[dep] for dep in dependencies if dep in self.pending]
+            self.pending[key] = future
+        # The write runs with the default dbs of the computation
+        self.queue.put((key, future, waits, copy_context(), fn, args, kwargs))
+        return future
+
+    def _work(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                self.queue.task_done()
+                return
+            key, future, waits, context, fn, args, kwargs = task
+            try:
+                for wait in waits:
+                    wait.result()
+                future.set_result(context.run(fn, *args, **kwargs))
+            except BaseException as error:
+                future.set_exception(error)
+                with self.lock:
+                    self.errors.append(error)
+            finally:
+                with self.lock:
+                    if self.pending.get(key) is future:
+                        del self.pending[key]
+                self.queue.task_done()
+
+    def is_pending(self, key):
+        return key in self.pending
+
+    def wait(self, keys):
+        '''Wait until the results with the given identity hashes are written, if they are being written'''
+        for key in keys:
+            future = self.pending.get(key)
+            if future is not None:
+                # The errors are raised by flush
+                future.exception()
+
+    def flush(self):
+        '''Wait until all the submitted results are written, and raise the first error if any write failed'''
+        self.queue.join()
+        with self.lock:
+            errors, self.errors = self.errors, []
+        if errors:
+            logging.error('%d results could not be written', len(errors))
+            raise errors[0]
+
+    def close(self):
+        '''Flush the results and stop the threads'''
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.closed = True
+            for _ in self.threads:
+                self.queue.put(None)
+            for thread in self.threads:
+                thread.join()
+            _writers.discard(self)
+
+
+@atexit.register
+def _close_writers():
+    for writer in list(_writers):
+        try:
+            writer.close()
+        except Exception:
+            logging.exception('Results could not be written before exiting')
@@ -7,7 +7,7 @@ cursor = list(db.list_results('accuracy'))
 rec_list = [db.recursive_get(res) for res in cursor]
 pprint(rec_list)
 print(len(rec_list))
-filtered = list(filter(lambda x: db.has_ancestor(x, {'kwargs':{'kernel': 'poly'}}), cursor))
+filtered = db.filter_by_ancestor(cursor, {'kwargs':{'kernel': 'poly'}})
 pprint(db.recursive_get(filtered[0]))
 pprint(len(filtered))
 
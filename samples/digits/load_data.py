@@ -3,7 +3,7 @@ from detl.wrapper import Wrapper
 from pprint import pprint
 
 db = db_client()
-acc_config = db.coll.find_one({'name':'accuracy'})
+acc_config = list(db.list_results('accuracy'))[0]
 pprint(acc_config)
 with db.as_default():   
     loaded_accuracy = Wrapper.from_hash(acc_config['config_hash'])
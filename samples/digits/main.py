@@ -1,6 +1,7 @@
 import pandas as pd
 from data import get_dataset, split
 from detl.mydb import db_client
+from detl.planner import materialize
 from svm import SVMClassifier, confusion_matrix, accuracy
 
 with db_client().as_default():
@@ -16,5 +17,7 @@ with db_client().as_default():
 
     pred = classifier.predict(X_test)
     
-    print(confusion_matrix(y_test, pred).data)
-    print('Accuracy', accuracy(y_test, pred).data)
+    # The confusion matrix and the accuracy are independent
+    conf_mat, acc = materialize([confusion_matrix(y_test, pred), accuracy(y_test, pred)], executor='thread')
+    print(conf_mat)
+    print('Accuracy', acc)
@@ -2,7 +2,6 @@ from detl.processor import load_and_save, identity_wrapper, Processor, change_st
 from sklearn import svm, metrics
 import numpy as np
 import pandas as pd
-from io_utils import pd_to_csv
 
 
 def flatten_sample(images):
@@ -42,7 +41,7 @@ class SVMClassifier(Processor):
         return predicted
 
 
-@load_and_save(pd.read_csv, pd_to_csv)
+@load_and_save()
 def confusion_matrix(expected, predicted):
         conf_mat = metrics.confusion_matrix(expected, predicted)
         return pd.DataFrame(conf_mat)
@@ -1,2 +1,36 @@
 # Idea is to compute all functions on all datapoints belonging to a data set one at a time and
-# use multiprocessing as well as automatic saving and loading
\ No newline at end of file
+# use multiprocessing as well as automatic saving and loading
+import numpy as np
+from detl import Dataset
+from detl.processor import load_and_save
+from detl.mydb import db_client
+
+
+def images(n):
+    '''A generator of images, read one at a time'''
+    rng = np.random.default_rng(0)
+    for _ in range(n):
+        yield rng.random((64, 64))
+
+
+@load_and_save()
+def normalize(image):
+    return (image - image.mean()) / image.std()
+
+
+@load_and_save()
+def histogram(image, bins=10):
+    return np.histogram(image, bins=bins)[0]
+
+
+if __name__ == '__main__':
+
+    db = db_client()
+
+    with db.as_default():
+
+        # Each image is identified by its position and its content, the histograms already saved are
+        # loaded, so an interrupted run resumes where it stopped
+        dataset = Dataset(images(10000), 'random_images').map(normalize).map(histogram, bins=20)
+        for hist in dataset.stream(executor='process', chunk_size=500):
+            print(hist)
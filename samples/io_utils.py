@@ -9,4 +9,6 @@ def json_dump(di, filename):
     with open(filename, 'w') as outfile:
         json.dump(di, outfile)
 
-
+def json_load(filename):
+    with open(filename, 'r') as infile:
+        return json.load(infile)
@@ -1,7 +1,26 @@
+import pandas as pd
+from io_utils import pd_to_csv, json_dump, json_load
+from detl.processor import load_and_save
+from detl.mydb import db_client
 
 
+@load_and_save(pd.read_csv, pd_to_csv)
+def multiply(x, y):
+    return pd.DataFrame(x) * y
+
+@load_and_save(json_load, json_dump)
+def statistics(df):
+    return {'mean': float(df.values.mean())}
+
+
+db = db_client()
+
 with db.as_default(lazy=True):
 
-    no_load = multiply(x,y)
+    # Nothing is looked up, loaded or computed here
+    no_load = multiply({'A': [0, 4, 8], 'B': [1, 5, 9]}, 5)
+    final = statistics(no_load)
 
-final = statistics(no_load)
+    # If the statistics are saved, the multiplication is neither loaded nor computed
+    print(final.explain())
+    print(final.data)
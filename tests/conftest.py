@@ -0,0 +1,20 @@
+from detl.mydb import MyDb
+from detl.backends import SqliteBackend
+import detl.cache
+import os
+import pytest
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    '''
+    An empty db in a temporary data folder, with the metadata in sqlite so that the tests do not need a mongo
+    server. The result cache and the execution counter of the tests are reset
+    '''
+    data_folder = str(tmp_path)
+    backend = SqliteBackend(os.path.join(data_folder, 'detl_test.sqlite'))
+    db = MyDb(data_folder=data_folder, backend=backend)
+    db.drop_all()
+    detl.cache.result_cache.clear()
+    pytest.execution_count = 0
+    return db
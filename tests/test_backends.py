@@ -0,0 +1,178 @@
+from detl.backends import MetadataBackend, SqliteBackend, MongoBackend, get_client, matches
+from bson.objectid import ObjectId
+import inspect
+import tempfile
+import shutil
+import os
+import pickle
+import pytest
+import unittest
+from unittest import mock
+
+
+class SqliteBackendTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+        self.backend = SqliteBackend(os.path.join(self.folder, 'metadata.sqlite'))
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder)
+
+    def test_insert_and_find(self):
+
+        parent_id = self.backend.insert({'config_hash': 'a', 'name': 'load', 'args': [1], 'kwargs': {}, 'parents': []})
+        child = {'config_hash': 'b', 'name': 'multiply_by', 'args': [parent_id, 2], 'kwargs': {'kernel': 'poly'},
+                 'parents': [parent_id]}
+        child_id = self.backend.insert(child)
+
+        assert type(child_id) is ObjectId
+        assert self.backend.find_one('b')['args'] == [parent_id, 2]
+        assert self.backend.find_one('c') is None
+        assert self.backend.find_id(parent_id)['config_hash'] == 'a'
+        assert sorted(doc['config_hash'] for doc in self.backend.find_many(['a', 'b', 'c'])) == ['a', 'b']
+        assert [doc['_id'] for doc in self.backend.list_results('multiply_by')] == [child_id]
+
+        # The same configuration keeps its id
+        child['file_descriptor'] = 'some_file'
+        assert self.backend.insert(child) == child_id
+        assert self.backend.find_one('b')['file_descriptor'] == 'some_file'
+
+        assert [doc['_id'] for doc in self.backend.find({'kwargs': {'kernel': 'poly'}})] == [child_id]
+        assert [doc['_id'] for doc in self.backend.find({'parents': parent_id})] == [child_id]
+
+        self.backend.drop()
+        assert self.backend.find_one('a') is None
+
+    # Make sure that the folder of the database is created, e.g. for the path data/detl.sqlite of the config
+    def test_missing_folder(self):
+
+        backend = SqliteBackend(os.path.join(self.folder, 'data', 'detl.sqlite'))
+        backend.insert({'config_hash': 'a', 'name': 'load', 'args': [], 'kwargs': {}, 'parents': []})
+        assert backend.find_one('a')['name'] == 'load'
+
+    # Make sure that the scans read all the documents by pages
+    def test_scan(self):
+
+        ids = [self.backend.insert({'config_hash': str(i), 'name': 'load', 'args': [i], 'kwargs': {}, 'parents': []})
+               for i in range(5)]
+        with mock.patch('detl.backends.SQLITE_SCAN_PAGE', 2):
+            assert [doc['_id'] for doc in self.backend.find({'args': {'$exists': True}})] == ids
+
+    def test_matches(self):
+
+        doc = {'name': 'svm', 'kwargs': {'kernel': 'poly', 'C': 1}, 'args': [1, 2]}
+        assert matches(doc, {'kwargs.kernel': 'poly'})
+        assert not matches(doc, {'kwargs': {'kernel': 'poly'}})
+        assert matches(doc, {'args': 2, 'name': {'$in': ['svm', 'knn']}})
+        assert matches(doc, {'file_descriptor': {'$exists': False}})
+
+    def insert_chain(self):
+
+        # load -> svm (kernel=poly) -> accuracy, and load -> accuracy without svm
+        load_id = self.backend.insert({'config_hash': 'load', 'name': 'load', 'args': [], 'kwargs': {}, 'parents': []})
+        svm_id = self.backend.insert({'config_hash': 'svm', 'name': 'svm', 'args': [load_id],
+                                      'kwargs': {'kernel': 'poly'}, 'parents': [load_id]})
+        acc_id = self.backend.insert({'config_hash': 'acc', 'name': 'accuracy', 'args': [svm_id], 'kwargs': {},
+                                      'parents': [svm_id]})
+        other_acc_id = self.backend.insert({'config_hash': 'acc2', 'name': 'accuracy', 'args': [load_id],
+                                            'kwargs': {}, 'parents': [load_id]})
+        return load_id, svm_id, acc_id, other_acc_id
+
+    def test_lineage(self):
+
+        load_id, svm_id, acc_id, other_acc_id = self.insert_chain()
+
+        expected = {acc_id: {acc_id, svm_id, load_id}, other_acc_id: {other_acc_id, load_id}}
+        assert self.backend.lineage([acc_id, other_acc_id]) == expected
+        # Walking up one level at a time gives the same lineage
+        assert MetadataBackend.lineage(self.backend, [acc_id, other_acc_id]) == expected
+
+    def test_filter_by_ancestor(self):
+
+        load_id, svm_id, acc_id, other_acc_id = self.insert_chain()
+
+        assert self.backend.filter_by_ancestor([acc_id, other_acc_id], {'kwargs': {'kernel': 'poly'}}) == [acc_id]
+        assert self.backend.filter_by_ancestor([acc_id, other_acc_id], {'name': 'load'}) == [acc_id, other_acc_id]
+
+
+class MongoClientTest(unittest.TestCase):
+
+    def test_shared_client(self):
+
+        first = MongoBackend('localhost', 27017, 'detl_test', 'first', maxPoolSize=4)
+        second = MongoBackend('localhost', 27017, 'detl_test', 'second', maxPoolSize=4)
+        other = MongoBackend('localhost', 27017, 'detl_test', 'first', maxPoolSize=8)
+
+        assert first.client is second.client
+        assert first.client is not other.client
+        assert first.client is get_client('localhost', 27017, maxPoolSize=4)
+        assert first.coll.name == 'first'
+
+        restored = pickle.loads(pickle.dumps(first))
+        assert restored.client is first.client
+        assert restored.options == {'maxPoolSize': 4}
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork')
+    def test_client_after_fork(self):
+
+        backend = MongoBackend('localhost', 27017, 'detl_test', 'first')
+        parent_client = backend.client
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                ok = backend.client is not parent_client and backend.client is backend.client
+                os.write(write, b'1' if ok else b'0')
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        assert os.read(read, 1) == b'1'
+        assert backend.client is parent_client
+
+
+class MongoMigrationTest(unittest.TestCase):
+
+    def setUp(self):
+
+        mongomock = pytest.importorskip('mongomock')
+        patches = [mock.patch('detl.backends.MongoClient', mongomock.MongoClient),
+                   mock.patch.dict('detl.backends._clients', clear=True)]
+        add_update = mongomock.collection.BulkOperationBuilder.add_update
+        if 'sort' not in inspect.signature(add_update).parameters:
+            # The bulk updates of recent pymongo versions have a sort option that mongomock does not know
+            patches.append(mock.patch.object(mongomock.collection.BulkOperationBuilder, 'add_update',
+                                             lambda bulk, *args, sort=None, **kwargs: add_update(bulk, *args, **kwargs)))
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.backend = MongoBackend('localhost', 27017, 'detl_test', 'migration')
+
+    # Make sure that the duplicated documents of an older collection are merged and the references rewritten
+    def test_migrate(self):
+
+        coll = self.backend.coll
+        without_file, with_file = ObjectId(), ObjectId()
+        coll.insert_many([{'_id': without_file, 'config_hash': 'load', 'name': 'load', 'args': [], 'kwargs': {}},
+                          {'_id': with_file, 'config_hash': 'load', 'name': 'load', 'args': [], 'kwargs': {},
+                           'file_descriptor': 'some_file'}])
+        svm_id = coll.insert_one({'config_hash': 'svm', 'name': 'svm', 'args': [without_file, 2],
+                                  'kwargs': {'data': with_file, 'kernel': 'poly'}}).inserted_id
+
+        # The unique index cannot be created before the migration
+        self.backend.ensure_indexes()
+        assert 'config_hash_unique' not in coll.index_information()
+        assert 'parents' in coll.index_information()
+
+        self.backend.migrate()
+
+        loads = list(coll.find({'config_hash': 'load'}))
+        assert [doc['_id'] for doc in loads] == [with_file]
+        svm = self.backend.find_id(svm_id)
+        assert svm['args'] == [with_file, 2]
+        assert svm['kwargs'] == {'data': with_file, 'kernel': 'poly'}
+        assert svm['parents'] == [with_file]
+        assert self.backend.find_id(with_file)['parents'] == []
+        assert coll.index_information()['config_hash_unique']['unique']
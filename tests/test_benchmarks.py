@@ -0,0 +1,36 @@
+from benchmarks.run import main, compare, load_history, machine
+import tempfile
+import shutil
+import os
+import unittest
+
+
+class BenchmarksTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+        self.results = os.path.join(self.folder, 'results.jsonl')
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder)
+
+    # Make sure that the suite runs and that the runs are stored
+    def test_run(self):
+
+        assert main(['--quick', '--results', self.results, '--data-folder', self.folder]) == 0
+        history = load_history(self.results, 'quick')
+        assert len(history) == 1 and history[0]['machine'] == machine()
+        metrics = history[0]['metrics']
+        assert {name.split('/')[0] for name in metrics} == {'decorator', 'hash', 'lookup', 'format', 'ancestor'}
+        assert all(value > 0 for value in metrics.values())
+        assert load_history(self.results, 'full') == []
+
+    def test_compare(self):
+
+        history = [{'metrics': {'find': 1e-3, 'save': 1.}}, {'metrics': {'find': 2e-3, 'save': 1.}},
+                   {'metrics': {'find': 3e-3}}]
+        rows, regressions = compare({'find': 2.4e-3, 'save': 1.3, 'load': 1.}, history, tolerance=0.25)
+        assert rows == [('find', 2.4e-3, 2e-3), ('save', 1.3, 1.), ('load', 1., None)]
+        assert regressions == ['save']
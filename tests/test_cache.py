@@ -0,0 +1,58 @@
+from detl.cache import LRUCache, sizeof
+import pytest
+import unittest
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_eviction(self):
+
+        cache = LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == 1
+        cache.put('c', 3)
+        # b is the least recently used
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert cache.info()['hits'] == 3
+        assert cache.info()['misses'] == 1
+
+    def test_accept(self):
+
+        cache = LRUCache()
+        cache.put('a', (None, {'_id'}))
+        assert cache.get('a', accept=lambda entry: entry[1] is None) is None
+        assert cache.misses == 1
+
+    def test_disabled(self):
+
+        cache = LRUCache(maxsize=0)
+        cache.put('a', 1)
+        assert len(cache) == 0
+
+    def test_sized_eviction(self):
+
+        cache = LRUCache(maxsize=100, sizeof=sizeof)
+        cache.put('a', b'a' * 40)
+        cache.put('b', b'b' * 40)
+        cache.put('c', b'c' * 40)
+        assert cache.get('a') is None
+        assert cache.size <= 100
+        # Larger than the whole cache
+        cache.put('d', b'd' * 200)
+        assert cache.get('d') is None
+        cache.resize(0)
+        assert len(cache) == 0
+
+
+class SizeofTest(unittest.TestCase):
+
+    def test_numpy_and_pandas(self):
+
+        np = pytest.importorskip('numpy')
+        pd = pytest.importorskip('pandas')
+        assert sizeof(np.zeros(1000)) == 8000
+        assert sizeof(pd.DataFrame({'a': np.zeros(1000)})) >= 8000
+        assert sizeof((np.zeros(10), np.zeros(10))) > 160
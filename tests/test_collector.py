@@ -0,0 +1,176 @@
+from detl.processor import load_and_save
+from detl.collector import GarbageCollector
+from test_util import save_int, load_int
+import detl.cache
+import numpy as np
+import time
+import os
+import unittest
+import pytest
+
+
+@load_and_save(load_int, save_int)
+def square(num):
+    pytest.execution_count += 1
+    return num * num
+
+
+@load_and_save()
+def zeros(num):
+    pytest.execution_count += 1
+    return np.full(1000, num)
+
+
+class CollectorTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def init_db(self, sqlite_db):
+
+        self.db = sqlite_db
+
+    def age(self, path, seconds=7200):
+
+        past = time.time() - seconds
+        os.utime(path, (past, past))
+
+    def refs(self, fd):
+
+        return self.db.store._blob(fd) + '.refs'
+
+    def stored_file(self, wrapper):
+
+        return self.db.find_file(wrapper.identity)
+
+    # Make sure that the abandoned files are deleted and the stored results kept
+    def test_orphans(self):
+
+        with self.db.as_default():
+            result = square(3)
+            assert result.data == 9
+        fd = self.stored_file(result)
+
+        orphan = self.db.store.temp_path()
+        save_int(5, orphan)
+        orphan, _ = self.db.store.put(orphan, orphan, 'deleted config')
+        recent = self.db.store.temp_path()
+        save_int(6, recent)
+        recent, _ = self.db.store.put(recent, recent, 'inserting config')
+        self.age(self.refs(orphan))
+        self.age(self.refs(fd))
+
+        interrupted = self.db.store.temp_path()
+        save_int(7, interrupted)
+        self.age(interrupted)
+
+        legacy_folder = os.path.join(self.db.data_folder, 'square')
+        os.mkdir(legacy_folder)
+        legacy = os.path.join(legacy_folder, '2019-01-01 00:00:00abcdef')
+        save_int(8, legacy)
+        self.age(legacy)
+
+        stats = self.db.collect_garbage()
+        assert stats['done'] and stats['temporary'] == 1 and stats['orphans'] == 2
+        assert not os.path.exists(orphan) and not os.path.exists(interrupted) and not os.path.exists(legacy)
+        assert os.path.exists(fd) and os.path.exists(recent)
+
+    # Make sure that the results whose file was deleted are computed again
+    def test_missing(self):
+
+        with self.db.as_default():
+            result = square(4)
+            assert result.data == 16
+        os.remove(self.stored_file(result))
+
+        stats = self.db.collect_garbage()
+        assert stats['missing'] == 1
+        assert self.db.find(result.identity) is not None
+        assert self.stored_file(result) is None
+
+        detl.cache.result_cache.clear()
+        with self.db.as_default():
+            assert square(4).data == 16
+        assert pytest.execution_count == 2
+        assert self.stored_file(result) is not None
+
+    # Make sure that the results least worth keeping are evicted first, and computed again when needed
+    def test_eviction(self):
+
+        with self.db.as_default():
+            results = [zeros(i) for i in range(4)]
+            for result in results:
+                result.data
+        sizes = [os.path.getsize(self.stored_file(result)) for result in results]
+        for result in results:
+            self.age(self.refs(self.stored_file(result)), 60)
+        # The oldest result is used again
+        self.age(self.refs(self.stored_file(results[0])), 10)
+        costs = {results[i].__id_hash__(): cost for i, cost in enumerate([1, 10, 1, 10])}
+
+        stats = self.db.collect_garbage(max_size=sum(sizes) - 1, cost=lambda doc: costs[doc['config_hash']])
+        assert stats['evicted'] == 1
+        assert [self.stored_file(result) is not None for result in results] == [True, True, False, True]
+
+        detl.cache.result_cache.clear()
+        pytest.execution_count = 0
+        with self.db.as_default():
+            assert [zeros(i).data[0] for i in range(4)] == [0, 1, 2, 3]
+        assert pytest.execution_count == 1
+
+    def orphans(self, count):
+
+        paths = []
+        for i in range(count):
+            path = self.db.store.temp_path()
+            save_int(i, path)
+            path, _ = self.db.store.put(path, path, 'config %d' % i)
+            self.age(path + '.refs')
+            paths.append(path)
+        return paths
+
+    # Make sure that the collection can be run by steps
+    def test_incremental(self):
+
+        orphans = self.orphans(5)
+        collector = GarbageCollector(self.db, batch_size=1)
+        steps = 0
+        while not collector.collect(max_seconds=0)['done']:
+            steps += 1
+        assert steps > 5
+        assert collector.stats['orphans'] == 5
+        assert not any(os.path.exists(path) for path in orphans)
+
+    # Make sure that the metadata is read by steps of batch_size documents
+    def test_streaming(self):
+
+        with self.db.as_default():
+            assert [square(i).data for i in range(6)] == [i * i for i in range(6)]
+
+        read = []
+        find = self.db.backend.find
+
+        def counting_find(query, projection=None):
+            for doc in find(query, projection):
+                read.append(doc)
+                yield doc
+
+        self.db.backend.find = counting_find
+        collector = GarbageCollector(self.db, batch_size=2)
+        counts = []
+        while not collector.collect(max_seconds=0)['done']:
+            counts.append(len(read))
+        assert len(read) == 6
+        assert max(b - a for a, b in zip([0] + counts, counts)) <= 2
+
+    # Make sure that the next calls of collect_garbage resume the collection
+    def test_resume(self):
+
+        orphans = self.orphans(5)
+        steps = 0
+        while not self.db.collect_garbage(max_seconds=0, batch_size=1)['done']:
+            steps += 1
+        assert steps > 5
+        assert not any(os.path.exists(path) for path in orphans)
+
+        # A new collection starts once it is complete
+        orphans = self.orphans(2)
+        assert self.db.collect_garbage()['orphans'] == 2
@@ -0,0 +1,135 @@
+from detl.db_context import db_context
+from detl.processor import load_and_save
+from detl.mydb import MyDb
+from detl.backends import SqliteBackend
+from test_util import save_int, load_int
+from concurrent.futures import ThreadPoolExecutor
+import detl
+import detl.cache
+import asyncio
+import threading
+import os
+import unittest
+import pytest
+
+
+@load_and_save(load_int, save_int)
+def add(first_int, second_int):
+    return first_int + second_int
+
+
+@load_and_save(load_int, save_int)
+def add_twice(first_int, second_int):
+    # An identified computation in the computation, in the worker
+    return add(first_int, second_int).data + second_int
+
+
+class ContextTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def init_db(self, tmp_path):
+
+        self.dbs = []
+        for name in ['first', 'second']:
+            folder = str(tmp_path / name)
+            os.mkdir(folder)
+            backend = SqliteBackend(os.path.join(folder, 'detl_test.sqlite'))
+            self.dbs.append(MyDb(data_folder=folder, backend=backend))
+
+    # Make sure that concurrent pipelines in threads use their own db and settings
+    def test_threads(self):
+
+        barrier = threading.Barrier(2)
+
+        def pipeline(db, lazy):
+            with db.as_default(lazy=lazy):
+                barrier.wait()
+                assert db_context.get_db() is db and db.lazy == lazy
+                result = add(1, 2)
+                barrier.wait()
+                return result.data, db_context.get_db() is db
+
+        with ThreadPoolExecutor(2) as pool:
+            results = list(pool.map(pipeline, self.dbs, [True, False]))
+        assert results == [(3, True), (3, True)]
+        assert db_context.get_db() is None
+        for db in self.dbs:
+            assert len(db.find_by_ancestors({'name': 'add'})) == 1
+
+    # Make sure that a context without budget does not restore the budget when another context changed it
+    def test_memory_budget(self):
+
+        first, second = self.dbs
+        budget = detl.cache.result_cache.maxsize
+        entered, exit = threading.Event(), threading.Event()
+
+        def pipeline():
+            with second.as_default():
+                entered.set()
+                exit.wait()
+                return add(1, 2).data
+
+        with ThreadPoolExecutor(1) as pool:
+            result = pool.submit(pipeline)
+            entered.wait()
+            with first.as_default(memory_budget=1000):
+                exit.set()
+                assert result.result() == 3
+                assert detl.cache.result_cache.maxsize == 1000
+        assert detl.cache.result_cache.maxsize == budget
+
+        # The budget of a db is used by its contexts only
+        db = MyDb(data_folder=first.data_folder, backend=first.backend, memory_budget=2000)
+        assert detl.cache.result_cache.maxsize == budget
+        with db.as_default():
+            assert detl.cache.result_cache.maxsize == 2000
+        assert detl.cache.result_cache.maxsize == budget
+
+    # Make sure that a result in memory for a db is inserted and saved in another db
+    def test_two_dbs(self):
+
+        for db in self.dbs:
+            with db.as_default():
+                assert add(add(1, 2), add(3, 4)).data == 10
+            assert len(db.find_by_ancestors({'name': 'add'})) == 3
+            assert len(os.listdir(db.store.objects_folder)) > 0
+
+    # Make sure that a result found in a db is referred to by its own id in the documents of another db
+    def test_parent_ids(self):
+
+        first, second = self.dbs
+        with first.as_default():
+            partial = add(1, 2)
+            assert partial.data == 3
+        with second.as_default():
+            assert add(1, 2).data == 3
+            assert add(partial, 3).data == 6
+
+        [partial_doc] = second.find_by_ancestors({'name': 'add', 'args': [1, 2]})
+        [doc] = [doc for doc in second.find_by_ancestors({'name': 'add'}) if doc['parents']]
+        assert doc['parents'] == [partial_doc['_id']]
+        assert doc['args'][0] == partial_doc['_id']
+
+    def test_asyncio(self):
+
+        async def pipeline(db, value):
+            with db.as_default():
+                await asyncio.sleep(0.01)
+                result = add(value, 1).data
+                await asyncio.sleep(0.01)
+                assert db_context.get_db() is db
+                return result
+
+        async def main():
+            return await asyncio.gather(*[pipeline(db, i) for i, db in enumerate(self.dbs)])
+
+        assert asyncio.run(main()) == [1, 2]
+
+    # Make sure that the identified computations in the workers use the db
+    def test_executors(self):
+
+        db = self.dbs[0]
+        for i, executor in enumerate(['thread', 'process']):
+            with db.as_default():
+                assert detl.materialize([add_twice(i, 10)], executor=executor) == [i + 20]
+            assert len(db.find_by_ancestors({'name': 'add', 'args': [i, 10]})) == 1
@@ -0,0 +1,138 @@
+from detl.dataset import Dataset, PartitionedSource, wrap_element, element_fingerprint
+from detl.processor import load_and_save
+from test_util import save_int, load_int
+import detl.cache
+import itertools
+import numpy as np
+import os
+import unittest
+import pytest
+
+
+@load_and_save(load_int, save_int)
+def square(num):
+    pytest.execution_count += 1
+    return num * num
+
+
+@load_and_save(load_int, save_int)
+def add(num, other=0):
+    return num + other
+
+
+@load_and_save(load_int, save_int)
+def count_lines(path):
+    pytest.execution_count += 1
+    with open(path) as fd:
+        return len(fd.readlines())
+
+
+@load_and_save(load_int, save_int)
+def total(*counts):
+    return sum(counts)
+
+
+class DatasetTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def init_db(self, sqlite_db):
+
+        self.db = sqlite_db
+
+    # Make sure that an interrupted run resumes from the elements already computed
+    def test_resume(self):
+
+        dataset = Dataset(range(100), 'numbers').map(square).map(add, other=1)
+
+        with self.db.as_default():
+            stream = dataset.stream(chunk_size=10)
+            assert list(itertools.islice(stream, 25)) == [i * i + 1 for i in range(25)]
+            stream.close()
+            assert pytest.execution_count == 30
+
+            assert list(dataset) == [i * i + 1 for i in range(100)]
+            assert pytest.execution_count == 100
+
+            found = self.db.find_by_ancestors({'name': 'add'}, {'dataset_element.key': 3})
+            expected = add(square(wrap_element(3, 'numbers', 3, fingerprint=element_fingerprint(3))), other=1)
+            assert [doc['config_hash'] for doc in found] == [expected.__id_hash__()]
+
+        self.db.drop_all()
+
+    # Make sure that the elements without key are identified by their content
+    def test_content(self):
+
+        with self.db.as_default():
+            assert list(Dataset([1, 2, 3], 'numbers').map(square)) == [1, 4, 9]
+            assert list(Dataset([5, 2, 7], 'numbers').map(square)) == [25, 4, 49]
+            assert pytest.execution_count == 5
+
+            arrays = [np.arange(3), np.ones(3)]
+            assert element_fingerprint(arrays[0]) == element_fingerprint(np.arange(3))
+            assert element_fingerprint(arrays[0]) != element_fingerprint(arrays[1])
+            with self.assertRaises(ValueError):
+                list(Dataset([object()], 'objects').map(square))
+
+        self.db.drop_all()
+
+    def test_executors(self):
+
+        dataset = Dataset(range(30), 'numbers', key=str).map(square)
+
+        with self.db.as_default():
+            assert list(dataset.stream(executor='process', max_workers=2, chunk_size=7)) == [i * i for i in range(30)]
+            assert pytest.execution_count == 0
+            detl.cache.result_cache.clear()
+            assert list(dataset.stream(executor='thread', chunk_size=7)) == [i * i for i in range(30)]
+            assert pytest.execution_count == 0
+
+        assert list(Dataset(range(3), 'numbers').map(square)) == [0, 1, 4]
+
+        self.db.drop_all()
+
+    # Make sure that the executors load the saved results and compute the others in the same chunk
+    def test_resume_executors(self):
+
+        for executor in ['thread', 'process']:
+            dataset = Dataset(range(20), executor, key=str).map(square)
+
+            with self.db.as_default():
+                stream = dataset.stream(executor=executor, max_workers=2, chunk_size=4)
+                assert list(itertools.islice(stream, 5)) == [i * i for i in range(5)]
+                stream.close()
+                detl.cache.result_cache.clear()
+                assert list(dataset.stream(executor=executor, max_workers=2, chunk_size=10)) == [
+                    i * i for i in range(20)]
+
+                detl.cache.result_cache.clear()
+                wrappers = [square(wrap_element(i, executor, str(i))) for i in range(16, 24)]
+                assert detl.materialize(wrappers, executor=executor, max_workers=2) == [
+                    i * i for i in range(16, 24)]
+
+        self.db.drop_all()
+
+    # Make sure that only the partitions that were added or modified are computed again
+    def test_partitions(self):
+
+        folder = os.path.join(self.db.data_folder, 'source')
+        os.mkdir(folder)
+        for i in range(4):
+            with open(os.path.join(folder, '%d.txt' % i), 'w') as fd:
+                fd.write('line\n' * i)
+
+        with self.db.as_default(lazy=True):
+            source = PartitionedSource.from_folder(folder, 'lines')
+            assert source.map(count_lines).reduce(total).data == 6
+            assert pytest.execution_count == 4
+
+            with open(os.path.join(folder, '1.txt'), 'a') as fd:
+                fd.write('line\n' * 10)
+            with open(os.path.join(folder, '4.txt'), 'w') as fd:
+                fd.write('line\n' * 4)
+
+            modified = PartitionedSource.from_folder(folder, 'lines')
+            assert modified.__id_hash__() != source.__id_hash__()
+            assert modified.map(count_lines).reduce(total).data == 20
+            assert pytest.execution_count == 6
+
+        self.db.drop_all()
@@ -0,0 +1,96 @@
+from detl.executor import graph
+from detl.planner import Plan
+from detl.processor import load_and_save, identity_wrapper, Processor
+from detl.wrapper import Wrapper, get_data
+from test_util import save_int, load_int
+import detl
+import detl.cache
+import os
+import unittest
+import pytest
+
+
+def multiply_by(first_int, second_int):
+    return first_int * second_int
+
+
+@load_and_save(load_int, save_int)
+def square(num):
+    return num * num
+
+
+@load_and_save(load_int, save_int)
+def add(first_int, second_int):
+    return first_int + second_int
+
+
+class Scaler(Processor):
+
+    def __init__(self, factor):
+
+        super(Scaler, self).__init__(factor)
+        self.factor = factor
+
+    @identity_wrapper()
+    def scale(self, num):
+        return num * get_data(self.factor)
+
+
+class GraphTest(unittest.TestCase):
+
+    def test_topological_order(self):
+
+        a = Wrapper(multiply_by, [2, 3], {})
+        b = Wrapper(multiply_by, [a, 4], {})
+        c = Wrapper(multiply_by, [a], {'second_int': b})
+
+        nodes = list(graph([c]).values())
+        assert nodes == [a, b, c]
+
+    def test_same_identity(self):
+
+        a = Wrapper(multiply_by, [2, 3], {})
+        other_a = Wrapper(multiply_by, [2, 3], {})
+        b = Wrapper(multiply_by, [other_a, 4], {})
+
+        nodes = graph([a, b])
+        assert list(nodes.values()) == [a, b]
+
+    def test_available_data(self):
+
+        a = Wrapper(multiply_by, [2, 3], {})
+        b = Wrapper(multiply_by, [a, 4], {})
+        b._data = 24
+
+        # The dependencies of b are not needed
+        assert list(graph([b]).values()) == [b]
+
+
+class ExecutorTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def init_db(self, sqlite_db):
+
+        self.db = sqlite_db
+
+    # Make sure that the wrappers held by the arguments are sent to the worker processes
+    def test_processor_argument(self):
+
+        with self.db.as_default():
+            scaler = Scaler(square(3))
+            assert detl.materialize([scaler.scale(square(2))], executor='process', max_workers=2) == [36]
+
+    # Make sure that a result planned to be loaded is computed with its dependencies if its file is deleted
+    def test_missing_file(self):
+
+        with self.db.as_default():
+            assert add(square(2), square(3)).data == 13
+
+        for executor in ['serial', 'thread', 'process']:
+            detl.cache.result_cache.clear()
+            with self.db.as_default():
+                result = add(square(2), square(3))
+                plan = Plan([result])
+                assert plan.pruned == 2
+                os.remove(self.db.find_file(result.identity))
+                assert plan.execute(executor=executor, max_workers=2) == [13]
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+from detl import fingerprint
+from detl.identity import Identity, h11
+import unittest
+from unittest import mock
+
+
+class IdentityTest(unittest.TestCase):
+
+    def test_hash_is_cached(self):
+
+        ident = Identity('multiply_by', 4, second_int=11)
+        first_hash = ident.__id_hash__()
+        # Mutating the arguments after the first call does not change the identity
+        ident.args = (5,)
+        assert ident.__id_hash__() == first_hash
+
+    def test_hash_depends_on_parents(self):
+
+        parent = Identity('load', 1)
+        other_parent = Identity('load', 2)
+        child = Identity('multiply_by', parent, 3)
+        other_child = Identity('multiply_by', other_parent, 3)
+
+        assert child.__id_hash__() != other_child.__id_hash__()
+        assert child.__id_hash__() == Identity('multiply_by', Identity('load', 1), 3).__id_hash__()
+
+    def test_hash_width(self):
+
+        # 128 bits digest
+        assert len(h11('some configuration')) == 32
+
+    def test_deep_chain(self):
+
+        ident = Identity('source', 0)
+        hashes = set()
+        for i in range(2000):
+            ident = Identity('step', ident, i % 7)
+            hashes.add(ident.__id_hash__())
+        assert len(hashes) == 2000
+
+    # Make sure that a deep graph can be hashed from its root, beyond the recursion limit
+    def test_deep_chain_hashed_at_once(self):
+
+        idents = [Identity('source', 0)]
+        for i in range(2000):
+            idents.append(Identity('step', idents[-1], i % 7))
+        root_hash = idents[-1].__id_hash__()
+
+        expected = Identity('source', 0).__id_hash__()
+        for i in range(2000):
+            expected = Identity('step', idents[i], i % 7).__id_hash__()
+        assert root_hash == expected
+
+    def test_parent_identities(self):
+
+        parent = Identity('load', 1)
+        other_parent = Identity('load', 2)
+        child = Identity('multiply_by', parent, 3, other=other_parent, factor=2)
+
+        assert child.parent_identities() == [(0, parent), ('other', other_parent)]
+
+    def test_array_arguments(self):
+
+        arr = np.arange(12).reshape(3, 4)
+        ident = Identity('multiply_by', arr, 2)
+
+        # The arrays are identified by their content, whatever their memory layout
+        assert ident.__id_hash__() == Identity('multiply_by', np.asfortranarray(arr), 2).__id_hash__()
+        assert ident.__id_hash__() != Identity('multiply_by', arr.astype(np.float64), 2).__id_hash__()
+        modified = arr.copy()
+        modified[1, 1] = 0
+        assert ident.__id_hash__() != Identity('multiply_by', modified, 2).__id_hash__()
+
+    # Make sure that the arrays fingerprinted for the hash are not fingerprinted again for the metadata
+    def test_array_fingerprinted_once(self):
+
+        arr = np.arange(12)
+        ident = Identity('multiply_by', arr, 2)
+        with mock.patch('detl.identity.array_fingerprint', wraps=fingerprint.array_fingerprint) as array_fingerprint:
+            ident.__id_hash__()
+            assert ident.to_dict()['args'] == [fingerprint.array_fingerprint(arr), 2]
+        assert array_fingerprint.call_count == 1
+
+    def test_large_array(self):
+
+        arr = np.arange(3 * fingerprint.CHUNK_SIZE // 8 + 5)
+        first = fingerprint.array_fingerprint(arr)
+        arr[-1] = 0
+        assert fingerprint.array_fingerprint(arr) != first
+
+        # The read only arrays are hashed once
+        arr.flags.writeable = False
+        assert fingerprint.array_fingerprint(arr) is fingerprint.array_fingerprint(arr)
+
+    def test_pandas_arguments(self):
+
+        pd = pytest.importorskip('pandas')
+
+        df = pd.DataFrame({'A': np.arange(3), 'B': ['x', 'y', 'z']}, index=['i', 'j', 'k'])
+        ident = Identity('multiply_by', df, 2)
+        assert ident.__id_hash__() == Identity('multiply_by', df.copy(), 2).__id_hash__()
+        modified = df.copy()
+        modified.loc['i', 'B'] = 'w'
+        assert ident.__id_hash__() != Identity('multiply_by', modified, 2).__id_hash__()
+        assert ident.__id_hash__() != Identity('multiply_by', df.set_index('B'), 2).__id_hash__()
+        assert Identity('accuracy', df['A']).__id_hash__() != Identity('accuracy', df['A'].rename('C')).__id_hash__()
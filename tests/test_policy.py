@@ -0,0 +1,94 @@
+from detl.processor import load_and_save
+from detl.policy import IoModel, decide
+from test_util import save_int, load_int
+import detl.cache
+import time
+import os
+import unittest
+import pytest
+
+
+@load_and_save(load_int, save_int)
+def slow_square(num):
+    pytest.execution_count += 1
+    time.sleep(0.05)
+    return num * num
+
+
+@load_and_save(load_int, save_int)
+def increment(num):
+    pytest.execution_count += 1
+    return num + 1
+
+
+@load_and_save(load_int, save_int, policy='recompute')
+def double(num):
+    pytest.execution_count += 1
+    return 2 * num
+
+
+class PolicyTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def init_db(self, sqlite_db):
+
+        self.db = sqlite_db
+
+    # Make sure that the compute, save and load times are recorded
+    def test_stats(self):
+
+        with self.db.as_default():
+            result = slow_square(3)
+            assert result.data == 9
+            doc = self.db.find(result.identity)
+            assert doc['compute_time'] >= 0.05
+            assert doc['save_time'] > 0 and doc['output_size'] > 0 and doc['artifact']['size'] == 1
+
+            detl.cache.result_cache.clear()
+            assert slow_square(3).data == 9
+        assert pytest.execution_count == 1
+        assert self.db.backend.find_one(result.__id_hash__())['load_time'] > 0
+
+    # Make sure that the results kept in memory are computed again by the next runs only
+    def test_memory(self):
+
+        with self.db.as_default(policy='memory'):
+            result = increment(1)
+            assert result.data == 2
+            assert increment(1).data == 2
+            assert pytest.execution_count == 1
+            assert self.db.find(result.identity) is not None
+            assert self.db.find_file(result.identity) is None
+
+            # The function overrides the policy of the db
+            assert double(2).data == 4
+            assert double(2).data == 4
+            assert pytest.execution_count == 3
+
+        detl.cache.result_cache.clear()
+        with self.db.as_default():
+            assert increment(1).data == 2
+            assert increment(1).data == 2
+        assert pytest.execution_count == 4
+        assert self.db.find_file(result.identity) is not None
+
+    # Make sure that only the results longer to compute than to save and load are saved
+    def test_auto(self):
+
+        with self.db.as_default(policy='auto'):
+            assert slow_square(2).data == 4
+            assert increment(2).data == 3
+            assert self.db.find_file(slow_square(2).identity) is not None
+            assert self.db.find_file(increment(2).identity) is None
+
+    def test_decide(self):
+
+        assert decide(None, 0, 0) == 'persist'
+        assert decide('memory', 10, 0) == 'memory'
+        with pytest.raises(ValueError):
+            decide('always', 10, 0)
+
+        model = IoModel(latency=0.01, read_throughput=100, write_throughput=100)
+        assert model.load_time(100) == pytest.approx(1.01)
+        model.record('read', 1000 * 1000, 0.01 + 1000)
+        assert model.throughput['read'] == pytest.approx(100 * 0.8 + 1000 * 0.2)
@@ -1,30 +1,18 @@
 import detl
+import detl.cache
 from detl.processor import load_and_save, identity_wrapper, Processor, change_state
-from detl.mydb import MyDb
-import shutil
 import os
 from test_util import save_int, load_int
 import unittest
 import pytest
-from detl.wrapper import wrap_obj, wrap_results
+from detl.wrapper import Wrapper, wrap_obj, wrap_results
 
 class DecoratorTest(unittest.TestCase):
 
     @pytest.fixture(autouse=True)
-    def init_db(self):
+    def init_db(self, sqlite_db):
 
-        host = 'localhost'
-        port = 27017
-        db = 'detl_test_db'
-        collection = 'decorator_test_coll'
-        dummy_data_folder = 'dummy_data'
-
-        if os.path.exists(dummy_data_folder):
-            shutil.rmtree(dummy_data_folder)
-        os.mkdir(dummy_data_folder)
-
-        self.db = MyDb(host, port, db, collection, dummy_data_folder)
-        self.db.drop_all()
+        self.db = sqlite_db
 
 
     # Make sure that the function is not recomputed the second time we run load_and_save
@@ -105,3 +93,214 @@ class DecoratorTest(unittest.TestCase):
 
 #        self.db.drop_all()
         assert False
+
+    # Make sure that the ancestors of a saved result are not planned nor computed in lazy mode
+    def test_lazy(self):
+
+        pytest.execution_count = 0
+
+        @load_and_save(load_int, save_int)
+        def multiply_by(first_int, second_int):
+            pytest.execution_count += 1
+            return first_int * second_int
+
+        with self.db.as_default(lazy=True):
+            a = multiply_by(2, 3)
+            b = multiply_by(a, 4)
+            assert b.data == 24
+            assert pytest.execution_count == 2
+
+        detl.cache.result_cache.clear()
+        with self.db.as_default(lazy=True):
+            b = multiply_by(multiply_by(2, 3), 4)
+            assert '1 pruned' in b.explain()
+            assert b.data == 24
+            assert pytest.execution_count == 2
+
+        self.db.drop_all()
+
+    # Make sure that materialize returns the results in input order and loads the saved ones
+    def test_materialize(self):
+
+        pytest.execution_count = 0
+
+        @load_and_save(load_int, save_int)
+        def multiply_by(first_int, second_int):
+            pytest.execution_count += 1
+            return first_int * second_int
+
+        with self.db.as_default():
+            results = detl.materialize([multiply_by(i, 3) for i in range(50)], executor='thread')
+            assert results == [3 * i for i in range(50)]
+            assert pytest.execution_count == 50
+
+        detl.cache.result_cache.clear()
+        with self.db.as_default():
+            results = detl.materialize([multiply_by(i, 3) for i in reversed(range(60))])
+            assert results == [3 * i for i in reversed(range(60))]
+            assert pytest.execution_count == 60
+
+        self.db.drop_all()
+
+    # Make sure that the results can be found from the keyword arguments of their ancestors
+    def test_find_by_ancestors(self):
+
+        @load_and_save(load_int, save_int)
+        def multiply_by(first_int, second_int=1):
+            return first_int * second_int
+
+        @load_and_save(load_int, save_int)
+        def add(first_int, second_int=0):
+            return first_int + second_int
+
+        with self.db.as_default():
+            for i in range(3):
+                add(multiply_by(i, second_int=2), second_int=i).data
+            add(5, second_int=1).data
+
+        found = self.db.find_by_ancestors({'name': 'add'}, {'second_int': 2})
+        assert sorted(res['kwargs']['second_int'] for res in found) == [0, 1, 2]
+        found = self.db.find_by_ancestors({'name': 'add'}, {'multiply_by.second_int': 2, 'add.second_int': 1})
+        assert len(found) == 1
+        assert len(self.db.find_by_ancestors({'name': 'add'}, ancestor_names=['multiply_by'])) == 3
+
+        self.db.drop_all()
+
+    # Make sure that the format is chosen from the type of the results by default
+    def test_default_format(self):
+
+        import numpy as np
+
+        @load_and_save()
+        def arange(n):
+            return np.arange(n)
+
+        with self.db.as_default():
+            arange(5).data
+        detl.cache.result_cache.clear()
+
+        assert self.db.find_by_ancestors({'name': 'arange'})[0]['format'] == 'npy'
+        with self.db.as_default():
+            np.testing.assert_array_equal(arange(5).data, np.arange(5))
+
+        self.db.drop_all()
+
+    # Make sure that the outputs of a function are saved in one file and loaded separately
+    def test_unpack(self):
+
+        import numpy as np
+
+        pytest.execution_count = 0
+
+        @load_and_save(unpack=3)
+        def split(n):
+            pytest.execution_count += 1
+            return np.arange(n), np.ones(n), {'n': n}
+
+        with self.db.as_default():
+            first, second, third = split(4)
+            assert third.data == {'n': 4}
+            assert pytest.execution_count == 1
+        detl.cache.result_cache.clear()
+        self.db.meta_cache.clear()
+
+        with self.db.as_default():
+            first, second, third = split(4)
+            np.testing.assert_array_equal(second.data, np.ones(4))
+            assert isinstance(second.data, np.memmap)
+            np.testing.assert_array_equal(first.data, np.arange(4))
+            assert pytest.execution_count == 1
+
+        docs = self.db.find_by_ancestors({'name': 'index_unpackable'})
+        assert sorted(doc['index'] for doc in docs) == [0, 1, 2]
+        assert len({doc['file_descriptor'] for doc in docs}) == 1
+
+        # An output is loaded alone from its hash
+        with self.db.as_default():
+            np.testing.assert_array_equal(Wrapper.from_hash(second.__id_hash__()).data, np.ones(4))
+
+        self.db.drop_all()
+
+    # Make sure that identical results of different configurations are saved once
+    def test_deduplication(self):
+
+        @load_and_save(load_int, save_int)
+        def multiply_by(first_int, second_int):
+            return first_int * second_int
+
+        with self.db.as_default():
+            multiply_by(2, 6).data
+            multiply_by(3, 4).data
+            multiply_by(3, 5).data
+
+        fds = {doc['args'][1]: doc['file_descriptor']
+               for doc in self.db.find_by_ancestors({'name': 'multiply_by'})}
+        assert fds[6] == fds[4] != fds[5]
+        assert len(self.db.store.refs(fds[6])) == 2
+
+        self.db.drop_all()
+
+    # Make sure that the results written in the background are all inserted when the context exits
+    def test_write_behind(self):
+
+        import threading
+        saving = threading.Event()
+
+        def slow_save(int_num, filepath):
+            saving.wait(5)
+            save_int(int_num, filepath)
+
+        @load_and_save(load_int, slow_save)
+        def multiply_by(first_int, second_int):
+            return first_int * second_int
+
+        with self.db.as_default(write_behind=True):
+            chained = multiply_by(multiply_by(4, 3), 2)
+            assert chained.data == 24
+            # Computed without waiting for the saves
+            assert len(self.db.find_by_ancestors({'name': 'multiply_by'})) == 0
+            saving.set()
+
+        docs = {doc['_id']: doc for doc in self.db.find_by_ancestors({'name': 'multiply_by'})}
+        assert len(docs) == 2
+        assert [docs[parent]['args'] for doc in docs.values() for parent in doc['parents']] == [[4, 3]]
+
+        @load_and_save(load_int, save_int)
+        def fails(first_int):
+            return 'not an int'
+
+        with self.assertRaises(AssertionError):
+            with self.db.as_default(write_behind=True):
+                fails(1).data
+
+        self.db.drop_all()
+
+    # Make sure that the results computed from unpacked outputs are written after them in write behind mode
+    def test_write_behind_unpacked(self):
+
+        import threading
+        saving = threading.Event()
+
+        def slow_save(int_num, filepath):
+            saving.wait(5)
+            save_int(int_num, filepath)
+
+        @load_and_save(load_int, slow_save, unpack=2)
+        def split(num):
+            return num, num + 1
+
+        @load_and_save(load_int, save_int)
+        def fit(num):
+            return 2 * num
+
+        with self.db.as_default(write_behind=True):
+            first, second = split(5)
+            assert fit(first).data == 10
+            saving.set()
+
+        parent_id = self.db.find(first.identity)['_id']
+        doc = self.db.find_by_ancestors({'name': 'fit'})[0]
+        assert doc['args'] == [parent_id] and doc['parents'] == [parent_id]
+        assert parent_id in doc['ancestors']
+
+        self.db.drop_all()
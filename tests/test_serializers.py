@@ -0,0 +1,46 @@
+from detl.serializers import save_auto, load_auto, serializer_for
+import numpy as np
+import pandas as pd
+import tempfile
+import shutil
+import os
+import unittest
+
+
+class SerializersTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder)
+
+    def save_and_load(self, obj, expected_format):
+
+        saved = save_auto(obj, os.path.join(self.folder, 'result'))
+        assert saved['format'] == expected_format
+        return load_auto(saved['file_descriptor'])
+
+    def test_ndarray(self):
+
+        arr = np.arange(12).reshape(3, 4)
+        loaded = self.save_and_load(arr, 'npy')
+        assert isinstance(loaded, np.memmap)
+        np.testing.assert_array_equal(loaded, arr)
+
+        # Arrays of objects are pickled
+        assert serializer_for(np.array([{}, 1], dtype=object)).name == 'pickle'
+
+    def test_dataframe(self):
+
+        df = pd.DataFrame({'A': np.arange(3), 'B': ['x', 'y', 'z'], 3: np.arange(3.)}, index=[5, 6, 7])
+        loaded = self.save_and_load(df, 'columns')
+        # The numeric columns are memory mapped
+        assert isinstance(loaded['A'].values, np.memmap)
+        pd.testing.assert_frame_equal(loaded.copy(), df)
+
+    def test_default(self):
+
+        assert self.save_and_load({'accuracy': 0.9}, 'pickle') == {'accuracy': 0.9}
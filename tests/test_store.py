@@ -0,0 +1,127 @@
+from detl.store import ArtifactStore
+from detl.remote import DirectoryRemote, HttpRemote
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from functools import partial
+import threading
+import tempfile
+import shutil
+import os
+import unittest
+
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+        self.store = ArtifactStore(self.folder)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder)
+
+    def save(self, text, extension='', store=None):
+
+        path = (store or self.store).temp_path()
+        with open(path + extension, 'w') as fd:
+            fd.write(text)
+        return path
+
+    # Make sure that identical results are stored once and deleted with their last reference
+    def test_deduplication(self):
+
+        path = self.save('a')
+        first, _ = self.store.put(path, path, 'config 1')
+        path = self.save('a', '.txt')
+        second, _ = self.store.put(path, path + '.txt', 'config 2')
+        path = self.save('a', '.txt')
+        third, _ = self.store.put(path, path + '.txt', 'config 3')
+
+        assert first != second
+        assert second == third and second.endswith('.txt')
+        assert os.listdir(self.store.tmp_folder) == []
+        assert self.store.refs(second) == {'config 2', 'config 3'}
+
+        assert not self.store.release(second, 'config 2')
+        assert os.path.exists(second)
+        assert self.store.release(third, 'config 3')
+        assert not os.path.exists(second)
+        assert os.path.exists(first)
+
+    def test_folder(self):
+
+        paths = []
+        for i in range(2):
+            path = self.store.temp_path()
+            os.mkdir(path)
+            for name in ['x', 'y']:
+                with open(os.path.join(path, name), 'w') as fd:
+                    fd.write(name)
+            paths.append(self.store.put(path, path, 'config %d' % i)[0])
+
+        assert paths[0] == paths[1]
+        assert sorted(os.listdir(paths[0])) == ['x', 'y']
+
+    # Make sure that the results saved by a node are downloaded by the others and checked
+    def test_remote(self):
+
+        remote = DirectoryRemote(os.path.join(self.folder, 'remote'))
+        first = ArtifactStore(os.path.join(self.folder, 'first'), remote=remote)
+        second = ArtifactStore(os.path.join(self.folder, 'second'), remote=remote, max_local_size=10)
+
+        path = self.save('result', '.txt', store=first)
+        fd, artifact = first.put(path, path + '.txt', 'config')
+        local_fd = second.fetch(artifact, fd)
+        assert local_fd != fd
+        with open(local_fd) as result:
+            assert result.read() == 'result'
+
+        # The local cache of the second node only keeps the last result
+        path = self.save('other result', store=first)
+        other_fd, other_artifact = first.put(path, path, 'other config')
+        second.fetch(other_artifact, other_fd)
+        assert not os.path.exists(local_fd)
+        assert os.path.exists(second.fetch(artifact, fd))
+
+        with open(os.path.join(remote.root, other_artifact['digest'][:2], other_artifact['digest'][2:4],
+                               other_artifact['digest']), 'w') as corrupted:
+            corrupted.write('corrupted')
+        with self.assertRaises(IOError):
+            second.fetch(other_artifact, other_fd)
+
+    def test_http_remote(self):
+
+        os.mkdir(os.path.join(self.folder, 'remote'))
+        handler = partial(StandInHandler, directory=os.path.join(self.folder, 'remote'))
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            remote = HttpRemote('http://127.0.0.1:%d' % server.server_address[1])
+            first = ArtifactStore(os.path.join(self.folder, 'first'), remote=remote)
+            second = ArtifactStore(os.path.join(self.folder, 'second'), remote=remote)
+
+            path = first.temp_path()
+            os.mkdir(path)
+            for name in ['x', 'y']:
+                with open(os.path.join(path, name), 'w') as fd:
+                    fd.write(name)
+            fd, artifact = first.put(path, path, 'config')
+            assert sorted(os.listdir(second.fetch(artifact, fd))) == ['x', 'y']
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class StandInHandler(SimpleHTTPRequestHandler):
+    '''A local stand-in of an object store'''
+
+    def do_PUT(self):
+        path = self.translate_path(self.path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fd:
+            fd.write(self.rfile.read(int(self.headers['Content-Length'])))
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,82 @@
+from detl.processor import load_and_save
+from detl import trace
+from test_util import save_int, load_int
+import detl.cache
+import json
+import time
+import os
+import unittest
+import pytest
+
+
+@load_and_save(load_int, save_int)
+def slow_add(num, other):
+    time.sleep(0.02)
+    return num + other
+
+
+@load_and_save(load_int, save_int)
+def square(num):
+    return num * num
+
+
+class TraceTest(unittest.TestCase):
+
+    @pytest.fixture(autouse=True)
+    def init_db(self, sqlite_db):
+
+        self.db = sqlite_db
+
+    def test_spans(self):
+
+        with self.db.as_default(), trace.profile() as profile:
+            assert slow_add(slow_add(square(2), 1), 2).data == 7
+
+        phases = profile.phases()
+        assert phases['compute'][0] == 3 and phases['insert'][0] == 3 and phases['save'][0] == 3
+        assert phases['hash'][0] >= 3 and phases['find'][0] >= 3 and phases['data'][0] >= 1
+        assert profile.hit_rate() == 0
+        save = [span for span in profile.spans if span.phase == 'save'][0]
+        assert save.fields['bytes'] == 1 and save.name in ('square', 'slow_add')
+
+        seconds, path = profile.critical_path()
+        names = profile.names()
+        assert [names[node] for node in path] == ['square', 'slow_add', 'slow_add']
+        assert seconds >= 0.04
+        assert profile.slowest(1)[0][0] == 'slow_add'
+        assert 'Critical path' in profile.report()
+
+        # The results are loaded or taken from memory
+        with self.db.as_default(), trace.profile() as profile:
+            assert slow_add(slow_add(square(2), 1), 2).data == 7
+            detl.cache.result_cache.clear()
+            assert slow_add(square(2), 1).data == 5
+        assert profile.hit_rate() == 1
+        load = [span for span in profile.spans if span.phase == 'load'][0]
+        assert load.fields['bytes'] == 1
+
+    def test_chrome_trace(self):
+
+        path = os.path.join(self.db.data_folder, 'trace.json')
+        with self.db.as_default(executor='thread'), trace.profile(path):
+            assert slow_add(square(3), 1).data == 10
+
+        with open(path) as fd:
+            events = json.load(fd)['traceEvents']
+        assert {event['cat'] for event in events} >= {'hash', 'find', 'compute', 'save', 'insert'}
+        assert all(event['ph'] == 'X' and event['dur'] >= 0 for event in events)
+        assert 'compute slow_add' in [event['name'] for event in events]
+
+    # Make sure that no span is created without hook
+    def test_disabled(self):
+
+        created = []
+        init = trace.Span.__init__
+        trace.Span.__init__ = lambda span, *args, **kwargs: created.append(span) or init(span, *args, **kwargs)
+        try:
+            with self.db.as_default():
+                assert slow_add(square(4), 1).data == 17
+        finally:
+            trace.Span.__init__ = init
+        assert created == []
+        assert trace.hooks == []